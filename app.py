@@ -1,10 +1,30 @@
 import json
 import time
-import base64
+import asyncio
+import io
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
 from google import genai
 from google.genai import types
 
+try:
+    import orjson  # Optional: much faster JSON encoding/decoding
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # Optional: streaming parser for very large result lines
+except ImportError:
+    ijson = None
+
+try:
+    import pybase64 as b64  # Optional: SIMD-accelerated base64 decoding
+except ImportError:
+    import base64 as b64
+
 # Directories
 OUTPUT_RESULTS_DIR = Path("batch_output")
 OUTPUT_IMAGES_DIR = Path("card_images")
@@ -14,6 +34,22 @@ OUTPUT_IMAGES_DIR.mkdir(exist_ok=True)
 
 client = genai.Client()
 
+# Batch status polling (seconds). Backoff doubles while the job state is
+# unchanged and resets to the initial delay whenever the state moves on.
+POLL_INITIAL_DELAY = 2
+POLL_MAX_DELAY = 30
+
+# Threads used to decode and write images in parallel
+IMAGE_WRITE_WORKERS = 8
+
+# Result lines bigger than this are streamed with ijson (when installed)
+# instead of being parsed into a full object in one go
+STREAMING_PARSE_THRESHOLD = 32 * 1024 * 1024
+
+# Per-minute quotas used to pace uploads and batch submissions
+MAX_REQUESTS_PER_MINUTE = 60
+MAX_TOKENS_PER_MINUTE = 1_000_000
+
 SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
 VALUES = ["Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen", "King"]
 
@@ -24,6 +60,13 @@ VALUE_ORDER = {
     "Jack": "11", "Queen": "12", "King": "13"
 }
 
+# Every standard card as (suit, value, order number), in deck order
+_CARDS = [(s, v, VALUE_ORDER[v]) for s in SUITS for v in VALUES]
+
+# Key prefixes for the extra cards (ZZ so they sort after the standard cards)
+_JOKER_PREFIX = "ZZ_Joker"
+_CARD_BACK_PREFIX = "ZZ_ZZ"
+
 
 # ---------------------------------------------------------
 # CONSISTENT STYLE PROMPT (locked deck style)
@@ -95,30 +138,17 @@ VALUE_ORDER = {
 # - irregular borders, varying font sizes, blurry text, messy typography, 3d render, perspective tilt, crooked lines, art spilling over border, photorealistic photography.
 # """
 
-def build_prompt(value, suit, theme, technique, background):
-    # Logic: Face cards = Portraits / Characters. Number cards = Symmetrical Clusters.
-    is_face_card = str(value).lower() in ['k', 'q', 'j', 'king', 'queen', 'jack']
-
-    if is_face_card:
-        # Focus on a character bust/portrait
-        subject = f"A majestic portrait of a character representing the {value} of {suit}"
-        composition = "centered character bust, facing forward, vertical composition"
-    else:
-        # Focus on a decorative arrangement of objects
-        subject = f"A symmetrical decorative arrangement of {value} distinct items representing {suit}"
-        composition = "objects arranged in a tight central cluster, vertical composition"
-
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
+_PROMPT_TEMPLATE = """
+**ART STYLE:** {{technique}}.
+**THEME:** {{theme}}.
 **FORMAT:** Vertical Art Print (9:16 aspect ratio).
 
 **SUBJECT:**
 {subject}.
-The artwork must interpret the concept of "{value}" and "{suit}" using the visual language of {theme}.
+The artwork must interpret the concept of "{{value}}" and "{{suit}}" using the visual language of {{theme}}.
 
 **COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed. No borders.
+- **Background:** {{background}} texture. Full bleed. No borders.
 - **Layout:** {composition}.
 - **Spacing:** Keep the important details clustered in the CENTER. Leave empty negative space around the edges (so it doesn't get cut off by a frame later).
 - **Style:** Detailed, high-contrast, clean lines.
@@ -126,9 +156,51 @@ The artwork must interpret the concept of "{value}" and "{suit}" using the visua
 **NEGATIVE PROMPT:**
 - playing card, border, frame, corner text, numbers, letters, symbols, typography, zoomed out, table surface, 3d render, text, watermark.
 """
+
+# Face cards = Portraits / Characters. Number cards = Symmetrical Clusters.
+_FACE_TEMPLATE = _PROMPT_TEMPLATE.format(
+    # Focus on a character bust/portrait
+    subject="A majestic portrait of a character representing the {value} of {suit}",
+    composition="centered character bust, facing forward, vertical composition",
+)
+_NUMBER_TEMPLATE = _PROMPT_TEMPLATE.format(
+    # Focus on a decorative arrangement of objects
+    subject="A symmetrical decorative arrangement of {value} distinct items representing {suit}",
+    composition="objects arranged in a tight central cluster, vertical composition",
+)
+
+# Same generation settings object shared by every request. The tuple keeps
+# the shared value immutable; it serializes as a JSON array all the same.
+_GENERATION_CONFIG = {"responseModalities": ("TEXT", "IMAGE")}
+
+
+def _escape_braces(text):
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+@lru_cache(maxsize=16)
+def _deck_templates(theme, technique, background):
+    """Fill in the deck-wide fields once, leaving only {value}/{suit} per card."""
+    fixed = {
+        "theme": _escape_braces(theme),
+        "technique": _escape_braces(technique),
+        "background": _escape_braces(background),
+        "value": "{value}",
+        "suit": "{suit}",
+    }
+    return _FACE_TEMPLATE.format_map(fixed), _NUMBER_TEMPLATE.format_map(fixed)
+
+
+@lru_cache(maxsize=256)
+def build_prompt(value, suit, theme, technique, background):
+    is_face_card = str(value).lower() in ['k', 'q', 'j', 'king', 'queen', 'jack']
+    face_template, number_template = _deck_templates(theme, technique, background)
+    template = face_template if is_face_card else number_template
+    return template.format(value=value, suit=suit)
 # ---------------------------------------------------------
 # Build card back prompt (standard for all cards)
 # ---------------------------------------------------------
+@lru_cache(maxsize=256)
 def build_card_back_prompt(theme, technique, background):
     return f"""
 **ART STYLE:** {technique}.
@@ -156,41 +228,41 @@ The design should be symmetrical, ornate, and reflect the {theme} theme.
 # Build all requests
 # ---------------------------------------------------------
 def build_requests(theme: str, technique: str, background: str):
+    # One request per card on purpose: "contents" is a single conversation,
+    # so packing several prompts into it yields one reply to the last turn
+    # rather than one image per prompt. Request overhead is already
+    # amortized by submitting everything as a single batch job.
     requests = []
 
     # Generate 52 standard cards (4 suits × 13 values)
-    for suit in SUITS:
-        for value in VALUES:
-            prompt = build_prompt(value, suit, theme, technique, background)
-            num = VALUE_ORDER.get(value, "00")
-            key = f"{suit}_{num}_{value}"
-
-            requests.append({
-                "key": key,
-                "request": {
-                    "contents": [{"parts": [{"text": prompt}]}],
-                    "generation_config": {"responseModalities": ["TEXT", "IMAGE"]}
-                }
-            })
+    for suit, value, num in _CARDS:
+        prompt = build_prompt(value, suit, theme, technique, background)
+        requests.append({
+            "key": f"{suit}_{num}_{value}",
+            "request": {
+                "contents": [{"parts": [{"text": prompt}]}],
+                "generation_config": _GENERATION_CONFIG
+            }
+        })
 
     # Add 2 Jokers
     for i in range(1, 3):
         prompt = build_prompt("Joker", "Wild", theme, technique, background)
         requests.append({
-            "key": f"ZZ_Joker_{13 + i:02d}_Joker{i}",
+            "key": f"{_JOKER_PREFIX}_{13 + i:02d}_Joker{i}",
             "request": {
                 "contents": [{"parts": [{"text": prompt}]}],
-                "generation_config": {"responseModalities": ["TEXT", "IMAGE"]}
+                "generation_config": _GENERATION_CONFIG
             }
         })
 
     # Add card back design request (ZZ prefix so it appears last)
     card_back_prompt = build_card_back_prompt(theme, technique, background)
     requests.append({
-        "key": "ZZ_ZZ_00_Card-Back",
+        "key": f"{_CARD_BACK_PREFIX}_00_Card-Back",
         "request": {
             "contents": [{"parts": [{"text": card_back_prompt}]}],
-            "generation_config": {"responseModalities": ["TEXT", "IMAGE"]}
+            "generation_config": _GENERATION_CONFIG
         }
     })
 
@@ -200,74 +272,152 @@ def build_requests(theme: str, technique: str, background: str):
 # ---------------------------------------------------------
 # Write JSONL
 # ---------------------------------------------------------
+def _dumps_line(obj):
+    if orjson is not None:
+        return orjson.dumps(obj) + b"\n"
+    return (json.dumps(obj) + "\n").encode("utf-8")
+
+
+def _loads_line(line):
+    if orjson is not None:
+        return orjson.loads(line)
+    return json.loads(line)
+
+
 def write_jsonl(requests, filename="deck.jsonl"):
+    # Keep the serialized bytes so the upload can be served from memory
+    # instead of reading the file straight back off disk
+    data = b"".join(_dumps_line(r) for r in requests)
     path = Path(filename)
-    with open(path, "w", encoding="utf-8") as f:
-        for r in requests:
-            f.write(json.dumps(r) + "\n")
-    return path
+    with open(path, "wb") as f:
+        f.write(data)
+    return path, data
 
 
 # ---------------------------------------------------------
 # Build retry requests for failed keys
 # ---------------------------------------------------------
+# Standard card keys look like "Hearts_01_Ace" or "Clubs_06_6"
+_KEY_RE = re.compile(r"^(?P<suit>[A-Za-z]+)_(?P<num>\d+)_(?P<value>[A-Za-z0-9]+)$")
+
+
 def build_retry_requests(failed_keys, theme, technique, background):
     requests = []
     
     for key in failed_keys:
         # Parse the key to determine what card it is
-        if "Card-Back" in key:
+        if key.startswith(_CARD_BACK_PREFIX):
             prompt = build_card_back_prompt(theme, technique, background)
-        elif "Joker" in key:
+        elif key.startswith(_JOKER_PREFIX):
             prompt = build_prompt("Joker", "Wild", theme, technique, background)
         else:
-            # Parse key like "Hearts_01_Ace" or "Clubs_06_6"
-            parts = key.split("_")
-            if len(parts) >= 3:
-                suit = parts[0]
-                value = parts[2]
-                prompt = build_prompt(value, suit, theme, technique, background)
-            else:
+            m = _KEY_RE.match(key)
+            if m is None:
                 print(f"⚠️  Cannot parse key: {key}, skipping")
                 continue
+            prompt = build_prompt(m["value"], m["suit"], theme, technique, background)
         
         requests.append({
             "key": key,
             "request": {
                 "contents": [{"parts": [{"text": prompt}]}],
-                "generation_config": {"responseModalities": ["TEXT", "IMAGE"]}
+                "generation_config": _GENERATION_CONFIG
             }
         })
     
     return requests
 
 
+# ---------------------------------------------------------
+# Rate limiting (token bucket for requests/min and tokens/min)
+# ---------------------------------------------------------
+class RateLimiter:
+    """Sleep just long enough before each API call to stay within quota."""
+
+    def __init__(self, max_requests_per_minute=MAX_REQUESTS_PER_MINUTE,
+                 max_tokens_per_minute=MAX_TOKENS_PER_MINUTE):
+        self.max_requests_per_minute = max_requests_per_minute
+        self.max_tokens_per_minute = max_tokens_per_minute
+        self.available_request_capacity = max_requests_per_minute
+        self.available_token_capacity = max_tokens_per_minute
+        self.last_update_time = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.last_update_time
+        self.last_update_time = now
+        self.available_request_capacity = min(
+            self.available_request_capacity + self.max_requests_per_minute * elapsed / 60,
+            self.max_requests_per_minute,
+        )
+        self.available_token_capacity = min(
+            self.available_token_capacity + self.max_tokens_per_minute * elapsed / 60,
+            self.max_tokens_per_minute,
+        )
+
+    async def acquire(self, tokens=0):
+        # A single call can never need more than a full minute of tokens
+        tokens = min(tokens, self.max_tokens_per_minute)
+        while True:
+            self._refill()
+            if self.available_request_capacity >= 1 and self.available_token_capacity >= tokens:
+                self.available_request_capacity -= 1
+                self.available_token_capacity -= tokens
+                return
+
+            request_wait = max(0, 1 - self.available_request_capacity) * 60 / self.max_requests_per_minute
+            token_wait = max(0, tokens - self.available_token_capacity) * 60 / self.max_tokens_per_minute
+            await asyncio.sleep(max(request_wait, token_wait))
+
+
+def estimate_tokens(requests):
+    """Rough prompt token count (~4 characters per token)."""
+    return sum(
+        len(part["text"]) // 4
+        for r in requests
+        for content in r["request"]["contents"]
+        for part in content["parts"]
+    )
+
+
 # ---------------------------------------------------------
 # Submit Batch Job
 # ---------------------------------------------------------
-def run_batch(jsonl_path):
-    start_time = time.time()
-    uploaded = client.files.upload(
-        file=str(jsonl_path),
+async def upload_jsonl(jsonl_path, jsonl_bytes, limiter):
+    await limiter.acquire()
+    return await client.aio.files.upload(
+        file=io.BytesIO(jsonl_bytes),
         config=types.UploadFileConfig(display_name=jsonl_path.name, mime_type="jsonl")
     )
+
+
+async def run_batch(jsonl_path, uploaded, limiter, est_tokens=0):
+    start_time = time.time()
     print("Uploaded:", uploaded.name)
 
-    job = client.batches.create(
+    await limiter.acquire(est_tokens)
+    job = await client.aio.batches.create(
         model="gemini-2.5-flash-image",
         src=uploaded.name,
         config={"display_name": f"card-deck-{jsonl_path.stem}"}
     )
     print("Created job:", job.name)
 
-    # Poll
+    # Poll with exponential backoff
     done = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED"}
-    status = client.batches.get(name=job.name)
+    delay = POLL_INITIAL_DELAY
+    status = await client.aio.batches.get(name=job.name)
+    last_state = status.state.name
     while status.state.name not in done:
         print("Current state:", status.state.name)
         print(f"Elapsed: {int(time.time() - start_time)}s")
-        time.sleep(10)
-        status = client.batches.get(name=job.name)
+        await asyncio.sleep(delay)
+        status = await client.aio.batches.get(name=job.name)
+        if status.state.name != last_state:
+            last_state = status.state.name
+            delay = POLL_INITIAL_DELAY
+        else:
+            delay = min(delay * 2, POLL_MAX_DELAY)
 
     print(f"Total processing time: {int(time.time() - start_time)}s")
     print("Final state:", status.state.name)
@@ -277,26 +427,102 @@ def run_batch(jsonl_path):
 # ---------------------------------------------------------
 # Download and process results (without saving heavy JSONL)
 # ---------------------------------------------------------
-def download_results(batch_job):
+async def download_results(batch_job):
     if batch_job.state.name != "JOB_STATE_SUCCEEDED":
         print("Batch job failed.")
         return None
 
     file_name = batch_job.dest.file_name
-    bytes_content = client.files.download(file=file_name)
-    text = bytes_content.decode("utf-8")
+    bytes_content = await client.aio.files.download(file=file_name)
     
-    # Return the text directly instead of saving to file
-    # This avoids storing large base64 data on disk
+    # Return the raw bytes directly instead of saving to file
+    # This avoids storing large base64 data on disk, and skips decoding
+    # the whole blob into a second (equally large) string
     print("Downloaded results from Google (not saving to disk)")
     
-    return text
+    return bytes_content
 
 
 # ---------------------------------------------------------
 # Extract Base64 Images & Calculate Cost
 # ---------------------------------------------------------
-def extract_images(results_text, job_name, expected_keys=None):
+_PART_PREFIX = "response.candidates.item.content.parts.item"
+
+
+def _parse_large_line(line):
+    """Stream a result line, keeping only the fields extract_images reads."""
+    obj = {}
+    response = {}
+    candidates = []
+    parts = []
+    # While copying a whole subtree: (prefix, builder, target dict, key)
+    subtree = None
+
+    for prefix, event, value in ijson.parse(io.BytesIO(line)):
+        if subtree is not None:
+            build_prefix, builder, target, name = subtree
+            builder.event(event, value)
+            if prefix == build_prefix and event in ("end_map", "end_array"):
+                target[name] = builder.value
+                subtree = None
+            continue
+
+        # Fields copied whole: error, usage and the first candidate's images
+        if prefix in ("response.error", "response.usageMetadata"):
+            target, name = response, prefix.split(".")[-1]
+        elif prefix == _PART_PREFIX + ".inlineData" and len(candidates) == 1:
+            target, name = parts[-1], "inlineData"
+        else:
+            target = None
+
+        if target is not None:
+            if event in ("start_map", "start_array"):
+                builder = ijson.ObjectBuilder()
+                builder.event(event, value)
+                subtree = (prefix, builder, target, name)
+            else:
+                target[name] = value
+        elif prefix == "key" and event == "string":
+            obj["key"] = value
+        elif prefix == "response" and event == "start_map":
+            obj["response"] = response
+        elif prefix == "response.candidates" and event == "start_array":
+            response["candidates"] = candidates
+        elif prefix == "response.candidates.item" and event == "start_map":
+            candidates.append({})
+        elif len(candidates) != 1:
+            # Only the first candidate is ever used
+            continue
+        elif prefix == "response.candidates.item.content" and event == "start_map":
+            candidates[0]["content"] = {}
+        elif prefix == "response.candidates.item.content.parts" and event == "start_array":
+            candidates[0]["content"]["parts"] = parts
+        elif prefix == _PART_PREFIX and event == "start_map":
+            parts.append({})
+
+    return obj
+
+
+def _parse_result_line(line):
+    if ijson is not None and len(line) > STREAMING_PARSE_THRESHOLD:
+        return _parse_large_line(line)
+    return _loads_line(line)
+
+
+def _decode_and_write(out, b64_data):
+    data = b64.b64decode(b64_data, validate=False)
+    flags = os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0)
+    fd = os.open(out, flags, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    return out
+
+
+def extract_images(results_bytes, job_name, expected_keys=None):
     # Create subfolder using job name (extract just the ID part)
     # job.name format is typically "batches/xxxxx" so we extract the ID
     job_id = job_name.split("/")[-1] if "/" in job_name else job_name
@@ -312,65 +538,73 @@ def extract_images(results_text, job_name, expected_keys=None):
     failed_keys = []
     successful_keys = set()
     
-    # Process results text line by line
-    for line in results_text.strip().split("\n"):
-        if not line.strip():
-            continue
+    # Images are decoded and written in the background while parsing continues. The
+    # with block waits for every write even if parsing raises partway through.
+    pending_writes = []
+    with ThreadPoolExecutor(max_workers=IMAGE_WRITE_WORKERS) as pool:
+        # Process results line by line, parsing each line straight from bytes
+        lines = io.BytesIO(results_bytes)
+        for line in lines:
+            if not line.strip():
+                continue
 
-        obj = json.loads(line)
-        key = obj.get("key")
+            obj = _parse_result_line(line)
+            key = obj.get("key")
 
-        if "response" not in obj:
-            print(f"❌ No response for {key}")
-            failed_keys.append(key)
-            continue
-        
-        response = obj["response"]
-        
-        # Check for error in response
-        if "error" in response:
-            print(f"❌ Error for {key}: {response['error']}")
-            failed_keys.append(key)
-            continue
-        
-        # Check if candidates exist
-        if "candidates" not in response or not response["candidates"]:
-            print(f"❌ No candidates for {key}")
-            failed_keys.append(key)
-            continue
+            if "response" not in obj:
+                print(f"❌ No response for {key}")
+                failed_keys.append(key)
+                continue
+            
+            response = obj["response"]
+            
+            # Check for error in response
+            if "error" in response:
+                print(f"❌ Error for {key}: {response['error']}")
+                failed_keys.append(key)
+                continue
+            
+            # Check if candidates exist
+            if "candidates" not in response or not response["candidates"]:
+                print(f"❌ No candidates for {key}")
+                failed_keys.append(key)
+                continue
 
-        # Extract usage metadata for cost calculation
-        if "usageMetadata" in response:
-            usage = response["usageMetadata"]
-            total_prompt_tokens += usage.get("promptTokenCount", 0)
-            total_candidates_tokens += usage.get("candidatesTokenCount", 0)
+            # Extract usage metadata for cost calculation
+            if "usageMetadata" in response:
+                usage = response["usageMetadata"]
+                total_prompt_tokens += usage.get("promptTokenCount", 0)
+                total_candidates_tokens += usage.get("candidatesTokenCount", 0)
 
-        try:
-            parts = response["candidates"][0]["content"]["parts"]
-            image_found = False
-            
-            for p in parts:
-                if "inlineData" in p:
-                    data = base64.b64decode(p["inlineData"]["data"])
-                    mime = p["inlineData"]["mimeType"]
-                    ext = ".png" if "png" in mime else ".jpg"
-
-                    out = output_folder / f"{key}{ext}"
-                    with open(out, "wb") as img:
-                        img.write(data)
-                        
-                        total_images += 1
+            try:
+                parts = response["candidates"][0]["content"]["parts"]
+                image_found = False
+                
+                for p in parts:
+                    if "inlineData" in p:
+                        mime = p["inlineData"]["mimeType"]
+                        ext = ".png" if "png" in mime else ".jpg"
+
+                        out = output_folder / f"{key}{ext}"
+                        pending_writes.append(
+                            pool.submit(_decode_and_write, out, p["inlineData"]["data"])
+                        )
                         successful_keys.add(key)
                         image_found = True
-                        print(f"✅ Saved: {out.name}")
-            
-            if not image_found:
-                print(f"❌ No image data for {key}")
-                failed_keys.append(key)
                 
-        except (KeyError, IndexError) as e:
-            print(f"❌ Parse error for {key}: {e}")
-            failed_keys.append(key)
+                if not image_found:
+                    print(f"❌ No image data for {key}")
+                    failed_keys.append(key)
+                    
+            except (KeyError, IndexError) as e:
+                print(f"❌ Parse error for {key}: {e}")
+                failed_keys.append(key)
+    
+    # All writes have landed on disk; surface any that failed
+    for future in pending_writes:
+        out = future.result()
+        total_images += 1
+        print(f"✅ Saved: {out.name}")
     
     # Check for missing keys (requests that weren't in results at all)
     if expected_keys:
@@ -470,7 +704,7 @@ def display_options(options_dict, title):
 # ---------------------------------------------------------
 # MAIN
 # ---------------------------------------------------------
-def main():
+async def main():
     print("\n" + "═" * 60)
     print("  🎴  PLAYING CARD DECK GENERATOR  🎴")
     print("═" * 60)
@@ -511,12 +745,21 @@ def main():
 
     requests = build_requests(theme, technique, background)
     expected_keys = [r["key"] for r in requests]
-    jsonl = write_jsonl(requests)
+    jsonl, jsonl_bytes = write_jsonl(requests)
+
+    # Shared across the initial batch and all retries so quota carries over
+    limiter = RateLimiter()
 
-    batch_job, job_name = run_batch(jsonl)
+    uploaded = await upload_jsonl(jsonl, jsonl_bytes, limiter)
+    batch_job, job_name = await run_batch(
+        jsonl, uploaded, limiter, estimate_tokens(requests)
+    )
     if batch_job.state.name == "JOB_STATE_SUCCEEDED":
-        results = download_results(batch_job)
-        output_folder, failed_keys = extract_images(results, job_name, expected_keys)
+        results = await download_results(batch_job)
+        # Decoding and writing images is blocking work, keep it off the event loop
+        output_folder, failed_keys = await asyncio.to_thread(
+            extract_images, results, job_name, expected_keys
+        )
         
         # Retry loop for failed cards
         retry_count = 0
@@ -529,19 +772,27 @@ def main():
             print(f"{'═' * 60}")
             print(f"  Failed cards: {', '.join(failed_keys)}")
             
-            retry = input(f"\n🔄 Retry failed cards? (y/n): ").strip().lower()
+            # Build retry requests and start uploading them while the user decides
+            retry_requests = build_retry_requests(failed_keys, theme, technique, background)
+            retry_jsonl, retry_bytes = write_jsonl(retry_requests, f"deck_retry_{retry_count}.jsonl")
+            upload = asyncio.create_task(upload_jsonl(retry_jsonl, retry_bytes, limiter))
+            
+            retry = await asyncio.to_thread(input, f"\n🔄 Retry failed cards? (y/n): ")
+            retry = retry.strip().lower()
             if retry != 'y' and retry != 'yes':
+                # Unused uploads expire on their own
+                upload.cancel()
                 break
             
-            # Build retry requests
-            retry_requests = build_retry_requests(failed_keys, theme, technique, background)
-            retry_jsonl = write_jsonl(retry_requests, f"deck_retry_{retry_count}.jsonl")
-            
-            retry_batch, retry_job_name = run_batch(retry_jsonl)
+            retry_batch, retry_job_name = await run_batch(
+                retry_jsonl, await upload, limiter, estimate_tokens(retry_requests)
+            )
             if retry_batch.state.name == "JOB_STATE_SUCCEEDED":
-                retry_results = download_results(retry_batch)
+                retry_results = await download_results(retry_batch)
                 # Extract to same folder, only pass the failed keys as expected
-                _, failed_keys = extract_images(retry_results, job_name, failed_keys)
+                _, failed_keys = await asyncio.to_thread(
+                    extract_images, retry_results, job_name, failed_keys
+                )
         
         if failed_keys:
             print(f"\n⚠️  Warning: {len(failed_keys)} cards could not be generated:")
@@ -554,4 +805,4 @@ def main():
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
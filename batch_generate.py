@@ -3,14 +3,31 @@ Batch card generation script - mimics the cloud API batch processing
 Generates all 54 cards (52 standard + 2 jokers + 1 back) with progress tracking
 """
 
+import os
+
+# Must be set before CUDA is initialized; avoids fragmentation over 55 same-shape runs
+os.environ.setdefault("PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True")
+
 import torch
 from diffusers import ZImagePipeline
+from PIL import Image
+from tqdm import tqdm
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import json
 import time
+import zlib
 from datetime import datetime
 from typing import Optional
+from enum import IntEnum
 import sys
+import threading
+
+# Fast FP32 matmuls on Ampere+ (TF32); harmless elsewhere
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+# Shapes are fixed for a whole deck, so let cuDNN pick conv algorithms once
+torch.backends.cudnn.benchmark = True
 
 # Card configuration
 SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
@@ -24,6 +41,43 @@ VALUE_ORDER = {
     "Jack": "11", "Queen": "12", "King": "13"
 }
 
+_FACE_VALUES = frozenset({'k', 'q', 'j', 'king', 'queen', 'jack'})
+
+
+class CardKind(IntEnum):
+    """Which prompt a card uses; PIP/FACE double as indexes into _TEMPLATE_BY_KIND."""
+    PIP = 0
+    FACE = 1
+    JOKER = 2
+    BACK = 3
+
+
+def card_kind(value: str) -> CardKind:
+    """Kind of a standard card by its value."""
+    return CardKind.FACE if str(value).lower() in _FACE_VALUES else CardKind.PIP
+
+
+# Every card in deck order: (kind, value, suit, filename, display_name)
+_CARD_PLAN = tuple(
+    (card_kind(v), v, s, f"{s}_{VALUE_ORDER[v]}_{v}.png", f"{v} of {s}")
+    for s in SUITS for v in VALUES
+) + tuple(
+    (CardKind.JOKER, jn, js, f"ZZ_Joker_{jn}_Joker{int(jn) - 13}.png", f"Joker {int(jn) - 13}")
+    for js, jn, _ in JOKERS
+) + ((CardKind.BACK, "", "", "ZZ_ZZ_00_Card-Back.png", "Card Back"),)
+
+# generate_card()'s card_type names
+_KINDS_BY_CARD_TYPE = {
+    "standard": (CardKind.PIP, CardKind.FACE),
+    "joker": (CardKind.JOKER,),
+    "back": (CardKind.BACK,),
+}
+
+
+def card_seed(filename: str) -> int:
+    """Deterministic per-card seed, so reruns reproduce the same image for a card."""
+    return zlib.crc32(filename.encode()) & 0x7FFFFFFF
+
 
 def get_device():
     """Detect the best available device."""
@@ -35,28 +89,17 @@ def get_device():
         return "cpu"
 
 
-def build_prompt(value: str, suit: str, theme: str, technique: str, background: str) -> str:
-    """Build a prompt for generating card artwork."""
-    is_face_card = str(value).lower() in ['k', 'q', 'j', 'king', 'queen', 'jack']
-
-    if is_face_card:
-        subject = f"A majestic portrait of a character representing the {value} of {suit}"
-        composition = "centered character bust, facing forward, vertical composition"
-    else:
-        subject = f"A symmetrical decorative arrangement of {value} distinct items representing {suit}"
-        composition = "objects arranged in a tight central cluster, vertical composition"
-
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
+_PROMPT_TEMPLATE = """
+**ART STYLE:** {{technique}}.
+**THEME:** {{theme}}.
 **FORMAT:** Vertical Art Print (9:16 aspect ratio).
 
 **SUBJECT:**
 {subject}.
-The artwork must interpret the concept of "{value}" and "{suit}" using the visual language of {theme}.
+The artwork must interpret the concept of "{{value}}" and "{{suit}}" using the visual language of {{theme}}.
 
 **COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed. No borders.
+- **Background:** {{background}} texture. Full bleed. No borders.
 - **Layout:** {composition}.
 - **Spacing:** Keep the important details clustered in the CENTER. Leave empty negative space around the edges.
 - **Style:** Detailed, high-contrast, clean lines.
@@ -65,10 +108,16 @@ The artwork must interpret the concept of "{value}" and "{suit}" using the visua
 - playing card, border, frame, corner text, numbers, letters, symbols, typography, zoomed out, table surface, 3d render, text, watermark.
 """
 
+_FACE_TEMPLATE = _PROMPT_TEMPLATE.format(
+    subject="A majestic portrait of a character representing the {value} of {suit}",
+    composition="centered character bust, facing forward, vertical composition",
+)
+_NUMBER_TEMPLATE = _PROMPT_TEMPLATE.format(
+    subject="A symmetrical decorative arrangement of {value} distinct items representing {suit}",
+    composition="objects arranged in a tight central cluster, vertical composition",
+)
 
-def build_joker_prompt(joker_num: int, theme: str, technique: str, background: str) -> str:
-    """Build prompt for joker cards."""
-    return f"""
+_JOKER_TEMPLATE = """
 **ART STYLE:** {technique}.
 **THEME:** {theme}.
 **FORMAT:** Vertical Art Print (9:16 aspect ratio).
@@ -87,10 +136,7 @@ The character should be playful, mysterious, and embody chaos and unpredictabili
 - playing card, border, frame, corner text, numbers, letters, typography, zoomed out, 3d render, text, watermark.
 """
 
-
-def build_card_back_prompt(theme: str, technique: str, background: str) -> str:
-    """Build prompt for card back design."""
-    return f"""
+_CARD_BACK_TEMPLATE = """
 **ART STYLE:** {technique}.
 **THEME:** {theme}.
 **FORMAT:** Vertical Art Print (9:16 aspect ratio).
@@ -112,8 +158,170 @@ The design should be symmetrical, ornate, and reflect the {theme} theme.
 """
 
 
-def initialize_pipeline(device: str = None) -> ZImagePipeline:
-    """Initialize the Z-Image pipeline."""
+_TEMPLATE_BY_KIND = (_NUMBER_TEMPLATE, _FACE_TEMPLATE)
+
+
+def build_prompt(value: str, suit: str, theme: str, technique: str, background: str,
+                 kind: Optional[CardKind] = None) -> str:
+    """Build a prompt for generating card artwork.
+    
+    ``kind`` (PIP or FACE) is known for planned cards; otherwise it is derived from ``value``.
+    """
+    if kind is None:
+        kind = card_kind(value)
+    return _TEMPLATE_BY_KIND[kind].format_map({
+        "value": value, "suit": suit, "theme": theme,
+        "technique": technique, "background": background,
+    })
+
+
+def build_joker_prompt(joker_num: int, theme: str, technique: str, background: str) -> str:
+    """Build prompt for joker cards."""
+    return _JOKER_TEMPLATE.format_map({
+        "joker_num": joker_num, "theme": theme,
+        "technique": technique, "background": background,
+    })
+
+
+def build_card_back_prompt(theme: str, technique: str, background: str) -> str:
+    """Build prompt for card back design."""
+    return _CARD_BACK_TEMPLATE.format_map({
+        "theme": theme, "technique": technique, "background": background,
+    })
+
+
+QUANTIZE_MODES = ("8bit", "4bit", "fp8")
+BACKENDS = ("torch", "ort-cuda")
+SCHEDULERS = ("default", "unipc")
+
+
+def load_quantized_transformer(quantize: str, dtype: torch.dtype):
+    """Load the Z-Image transformer with bitsandbytes 8-bit/4-bit weights.
+    
+    Matmuls still run in ``dtype``; only the stored weights shrink.
+    """
+    from diffusers import BitsAndBytesConfig, ZImageTransformer2DModel
+    
+    if quantize == "8bit":
+        qcfg = BitsAndBytesConfig(load_in_8bit=True)
+    else:
+        qcfg = BitsAndBytesConfig(
+            load_in_4bit=True,
+            bnb_4bit_compute_dtype=dtype,
+            bnb_4bit_quant_type="nf4",
+        )
+    
+    return ZImageTransformer2DModel.from_pretrained(
+        "Tongyi-MAI/Z-Image-Turbo",
+        subfolder="transformer",
+        quantization_config=qcfg,
+        torch_dtype=dtype,
+    )
+
+
+def onnx_transformer_path(height: int, width: int) -> Path:
+    """Location of the exported ONNX transformer, next to the cached HF snapshot.
+    
+    Latent height/width are baked into the graph, so each resolution gets its own file.
+    """
+    from huggingface_hub import snapshot_download
+    
+    snapshot = snapshot_download("Tongyi-MAI/Z-Image-Turbo", allow_patterns=["model_index.json"])
+    return Path(snapshot) / "onnx" / f"zimage_transformer_{width}x{height}.onnx"
+
+
+class OrtTransformer(torch.nn.Module):
+    """Stand-in for pipe.transformer backed by an ONNX Runtime CUDA session.
+    
+    The graph is exported by scripts/export_onnx.py for one latent at a fixed
+    resolution, so each latent in the batch is one session run. Inputs and
+    outputs are bound straight to CUDA memory on torch's current stream, so
+    nothing round-trips through the host.
+    """
+    
+    def __init__(self, onnx_path: Path, in_channels: int, dtype: torch.dtype):
+        super().__init__()
+        import numpy as np
+        import onnxruntime as ort
+        
+        self._np_half = np.float16
+        self._np_float = np.float32
+        provider_options = {
+            "device_id": 0,
+            "cudnn_conv_algo_search": "EXHAUSTIVE",
+            "user_compute_stream": str(torch.cuda.current_stream().cuda_stream),
+        }
+        self.session = ort.InferenceSession(
+            str(onnx_path), providers=[("CUDAExecutionProvider", provider_options)]
+        )
+        self.in_channels = in_channels
+        self._dtype = dtype
+    
+    @property
+    def dtype(self) -> torch.dtype:
+        return self._dtype
+    
+    @property
+    def device(self) -> torch.device:
+        return torch.device("cuda")
+    
+    def _bind(self, binding, name: str, tensor: torch.Tensor, output: bool = False):
+        element_type = self._np_half if tensor.dtype == torch.float16 else self._np_float
+        bind = binding.bind_output if output else binding.bind_input
+        bind(name, "cuda", 0, element_type, tuple(tensor.shape), tensor.data_ptr())
+    
+    def forward(self, x, t, cap_feats, return_dict: bool = False):
+        t = t.float().contiguous()
+        out = []
+        for j, (latent, cap) in enumerate(zip(x, cap_feats)):
+            latent = latent.to(torch.float16).contiguous()
+            cap = cap.to(torch.float16).contiguous()
+            sample = torch.empty_like(latent)
+            
+            binding = self.session.io_binding()
+            self._bind(binding, "latent", latent)
+            self._bind(binding, "timestep", t[j:j + 1])
+            self._bind(binding, "cap_feats", cap)
+            self._bind(binding, "sample", sample, output=True)
+            self.session.run_with_iobinding(binding)
+            
+            out.append(sample.to(self._dtype))
+        return (out,)
+
+
+def initialize_pipeline(device: str = None, compile_model: bool = True,
+                        quantize: Optional[str] = None, backend: str = "torch",
+                        height: int = 1152, width: int = 640,
+                        scheduler: str = "default", low_vram: bool = False) -> ZImagePipeline:
+    """Initialize the Z-Image pipeline.
+    
+    On CUDA the denoiser is compiled with torch.compile (CUDA graphs) unless
+    ``compile_model`` is False. Shapes are not static: every prompt's caption
+    embedding has its own length, and the tail batch or an out-of-memory retry
+    changes the batch size. The caption dimension is therefore compiled dynamic
+    (see BatchGenerator.encode_prompts), so only a new batch size recompiles.
+    
+    ``quantize`` ("8bit", "4bit" or "fp8", CUDA only) shrinks the transformer
+    weights: 8bit/4bit load them through bitsandbytes, fp8 stores them as
+    float8_e4m3fn and upcasts each layer to bf16 as it runs.
+    
+    ``backend="ort-cuda"`` replaces the transformer with an ONNX Runtime
+    session exported for ``height`` x ``width`` by scripts/export_onnx.py.
+    
+    ``scheduler="unipc"`` swaps the flow-matching Euler sampler for UniPC
+    (a multistep DPM-Solver++-style solver) in flow mode, so fewer steps
+    keep more detail.
+    
+    ``low_vram`` (CUDA) keeps only the active submodule on the GPU via model
+    CPU offload, or offloads layer by layer on GPUs under 8 GB. torch.compile
+    is skipped then, since offloading moves the weights between calls.
+    
+    Attention runs through PyTorch SDPA, and the VAE decodes one image at a
+    time (tiled on MPS/CPU and on GPUs under 16 GB) to cap peak memory.
+    
+    No warm-up runs here: BatchGenerator.generate_all warms up on the deck's
+    first real batch, since a dummy prompt would compile shapes no card uses.
+    """
     if device is None:
         device = get_device()
     
@@ -127,17 +335,98 @@ def initialize_pipeline(device: str = None) -> ZImagePipeline:
     else:
         dtype = torch.float32
     
+    if backend == "ort-cuda" and device != "cuda":
+        print("⚠️  --backend ort-cuda needs CUDA; using PyTorch")
+        backend = "torch"
+    
+    if quantize and device != "cuda":
+        print(f"⚠️  --quantize {quantize} needs CUDA; loading full-precision weights")
+        quantize = None
+    
+    if backend == "ort-cuda":
+        onnx_path = onnx_transformer_path(height, width)
+        if not onnx_path.exists():
+            raise FileNotFoundError(
+                f"{onnx_path} not found. Export it first:\n"
+                f"  python scripts/export_onnx.py --height {height} --width {width}"
+            )
+        if quantize:
+            print("⚠️  --quantize is ignored with --backend ort-cuda")
+            quantize = None
+    
+    extra = {}
+    if backend == "ort-cuda":
+        # The ONNX session replaces the transformer, so don't load its weights
+        extra["transformer"] = None
+    elif quantize in ("8bit", "4bit"):
+        print(f"   Quantizing transformer weights to {quantize} (bitsandbytes)")
+        extra["transformer"] = load_quantized_transformer(quantize, dtype)
+    
     pipe = ZImagePipeline.from_pretrained(
         "Tongyi-MAI/Z-Image-Turbo",
         torch_dtype=dtype,
         low_cpu_mem_usage=True,
+        **extra,
     )
     
-    if device == "mps":
+    if scheduler == "unipc":
+        from diffusers import UniPCMultistepScheduler
+        print("   Using UniPC multistep scheduler")
+        pipe.scheduler = UniPCMultistepScheduler.from_config(
+            pipe.scheduler.config,
+            prediction_type="flow_prediction",
+            use_flow_sigmas=True,
+            flow_shift=pipe.scheduler.config.get("shift", 1.0),
+        )
+    
+    if quantize == "fp8":
+        print("   Storing transformer weights in FP8 (float8_e4m3fn)")
+        pipe.transformer.enable_layerwise_casting(
+            storage_dtype=torch.float8_e4m3fn, compute_dtype=dtype
+        )
+    
+    if low_vram and device == "cuda":
+        if torch.cuda.get_device_properties(0).total_memory < 8 * 1024**3:
+            print("   Low VRAM: sequential CPU offload (slow, but fits under 8 GB)")
+            pipe.enable_sequential_cpu_offload()
+        else:
+            print("   Low VRAM: model CPU offload")
+            pipe.enable_model_cpu_offload()
+        compile_model = False
+    elif device == "mps":
         pipe.enable_model_cpu_offload()
     else:
         pipe.to(device)
     
+    if backend == "torch":
+        # PyTorch SDPA; on CUDA pin the memory-efficient kernel, which also handles
+        # the padding mask of batched prompts
+        pipe.transformer.set_attention_backend("_native_efficient" if device == "cuda" else "native")
+    
+    if device == "cuda":
+        # NHWC layout for Tensor Cores; must happen before torch.compile
+        if backend == "torch" and quantize is None:
+            pipe.transformer.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+    
+    # Decode batches one image at a time, and in tiles where memory is tight
+    pipe.vae.enable_slicing()
+    if device != "cuda" or torch.cuda.get_device_properties(0).total_memory < 16 * 1024**3:
+        pipe.vae.enable_tiling()
+    
+    if backend == "ort-cuda":
+        print(f"   Running transformer with ONNX Runtime ({onnx_path.name})")
+        pipe.transformer = OrtTransformer(onnx_path, in_channels=16, dtype=dtype)
+    elif compile_model and device == "cuda":
+        print("⚙️  Compiling denoiser (compiles during warm-up)...")
+        import torch._inductor.config
+        torch._inductor.config.conv_1x1_as_mm = True
+        # One graph per batch size (full, tail, OOM-halved); the default limit of 8
+        # would silently drop back to eager partway through a deck
+        torch._dynamo.config.cache_size_limit = 64
+        denoiser = "transformer" if hasattr(pipe, "transformer") else "unet"
+        setattr(pipe, denoiser, torch.compile(getattr(pipe, denoiser), mode="reduce-overhead"))
+    
     print(f"✅ Pipeline ready on {device.upper()}!\n")
     return pipe
 
@@ -146,7 +435,8 @@ class BatchGenerator:
     """Batch card generator with progress tracking."""
     
     def __init__(self, output_dir: Path, theme: str, technique: str, background: str,
-                 height: int = 1152, width: int = 640, steps: int = 9, device: str = None):
+                 height: int = 1152, width: int = 640, steps: int = 9, device: str = None,
+                 batch_size: int = 1):
         self.output_dir = output_dir
         self.theme = theme
         self.technique = technique
@@ -155,92 +445,284 @@ class BatchGenerator:
         self.width = width
         self.steps = steps
         self.device = device if device else get_device()
+        self.batch_size = max(1, batch_size)
         
         self.output_dir.mkdir(exist_ok=True, parents=True)
         
+        # PNG encoding runs here while the GPU denoises the next batch
+        self._io_pool = ThreadPoolExecutor(max_workers=2)
+        self._pending = []
+        self._copy_stream = torch.cuda.Stream() if self.device == "cuda" else None
+        
+        # One generator per batch slot, reseeded for each card
+        self._generators = []
+        
         # Statistics
         self.total_cards = 55  # 52 + 2 jokers + 1 back
         self.completed = 0
         self.failed = 0
         self.start_time = None
-        self.results = []
+        self._done = {filename: card for filename, card in self._read_results().items()
+                      if card.get("status") == "success"}
         
-    def generate_card(self, pipe: ZImagePipeline, value: str, suit: str, 
-                     card_type: str = "standard") -> dict:
-        """Generate a single card and return result info."""
+        # Append-only, line-buffered log: one settings header per run, then one
+        # line per finished card, so an interrupted run keeps its manifest
+        self._jsonl_path = self.output_dir / "batch_results.jsonl"
+        self._jsonl_lock = threading.Lock()
+        self._jsonl_fp = open(self._jsonl_path, "a", buffering=1)
+        self._record({"timestamp": datetime.now().isoformat(), "settings": self._settings()})
+    
+    def _settings(self) -> dict:
+        """Deck settings that must match for a previous card to be reused."""
+        return {
+            "theme": self.theme, "technique": self.technique, "background": self.background,
+            "height": self.height, "width": self.width, "steps": self.steps,
+        }
+    
+    def _record(self, record: dict):
+        """Append one line to batch_results.jsonl (called from the I/O pool too)."""
+        with self._jsonl_lock:
+            self._jsonl_fp.write(json.dumps(record) + "\n")
+    
+    def _read_results(self) -> dict:
+        """Latest recorded result per filename, for cards made with this deck's settings.
+        
+        Reads batch_results.jsonl, falling back to the batch_results.json summary
+        of runs that predate it.
+        """
+        jsonl_path = self.output_dir / "batch_results.jsonl"
+        latest = {}
+        if jsonl_path.exists():
+            matches = False
+            with open(jsonl_path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # torn line from an interrupted run
+                    if "settings" in record:
+                        matches = record["settings"] == self._settings()
+                    elif "filename" in record:
+                        latest[record["filename"]] = record if matches else None
+            return {filename: card for filename, card in latest.items() if card is not None}
+        
+        results_file = self.output_dir / "batch_results.json"
+        if not results_file.exists():
+            return {}
+        try:
+            with open(results_file) as f:
+                previous = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        if {key: previous.get(key) for key in self._settings()} != self._settings():
+            return {}
+        return {card["filename"]: card for card in previous.get("cards", [])}
+    
+    def close(self):
+        """Wait for queued saves and close the results log."""
+        self._io_pool.shutdown(wait=True)
+        self._jsonl_fp.close()
+    
+    def _already_done(self, filename: str) -> Optional[dict]:
+        """Return the previous result if this card was generated and its file still exists."""
+        result = self._done.get(filename)
+        if result is not None and (self.output_dir / filename).exists():
+            return result
+        return None
+        
+    def _plan_card(self, kind: CardKind, value: str, suit: str,
+                   filename: str, display_name: str) -> tuple:
+        """Return (prompt, filename, display_name) for a _CARD_PLAN entry."""
+        if kind == CardKind.JOKER:
+            prompt = build_joker_prompt(int(value) - 13, self.theme, self.technique, self.background)
+        elif kind == CardKind.BACK:
+            prompt = build_card_back_prompt(self.theme, self.technique, self.background)
+        else:
+            prompt = build_prompt(value, suit, self.theme, self.technique, self.background, kind)
+        return prompt, filename, display_name
+    
+    def _failed_result(self, filename: str, display_name: str, error: Exception) -> dict:
+        """Count a failed card and return result info."""
+        self.failed += 1
+        tqdm.write(f"❌ Failed to generate {display_name}: {error}")
+        return {
+            "card": display_name,
+            "filename": filename,
+            "status": "failed",
+            "error": str(error)
+        }
+    
+    def _save_result(self, save, filename: str, display_name: str, elapsed: float) -> dict:
+        """Queue ``save(path)`` on the I/O pool, log the card and return result info.
+        
+        The result is provisional until _finish_saves() has seen the save complete;
+        the line logged to batch_results.jsonl is written once the save finishes.
+        """
+        result = {
+            "card": display_name,
+            "filename": filename,
+            "status": "success",
+            "time": f"{elapsed:.2f}s"
+        }
+        
+        def save_and_record():
+            try:
+                save(self.output_dir / filename)
+            except Exception as e:
+                self._record({**result, "status": "failed", "error": str(e)})
+                raise
+            self._record(result)
+        
+        future = self._io_pool.submit(save_and_record)
+        self.completed += 1
+        
+        # tqdm.write keeps log lines from mangling the progress bar
+        tqdm.write(f"✅ {display_name:20s} | {elapsed:5.2f}s")
+        
+        self._pending.append((future, result))
+        return result
+    
+    def _finish_saves(self):
+        """Wait for queued saves and mark any that failed."""
+        for future, result in self._pending:
+            error = future.exception()
+            if error is not None:
+                self.completed -= 1
+                result.update(self._failed_result(result["filename"], result["card"], error))
+        self._pending = []
+    
+    def _host_images(self, images: torch.Tensor) -> list:
+        """Start copying a (B, 3, H, W) image batch to pinned host memory.
+        
+        Returns one ``save(path)`` callable per image. The copy runs on a side
+        stream, so each callable waits for it before building the PIL image.
+        """
+        # Same quantization as diffusers' numpy_to_pil
+        images = (images * 255).round().to(torch.uint8)
+        host = torch.empty(images.shape, dtype=torch.uint8, pin_memory=True)
+        
+        self._copy_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(self._copy_stream):
+            host.copy_(images, non_blocking=True)
+            copied = torch.cuda.Event()
+            copied.record()
+        images.record_stream(self._copy_stream)
+        
+        def make_save(j):
+            def save(path):
+                copied.synchronize()
+                Image.fromarray(host[j].permute(1, 2, 0).numpy()).save(path)
+            return save
+        
+        return [make_save(j) for j in range(len(host))]
+    
+    def encode_prompts(self, pipe: ZImagePipeline, plans: list) -> list:
+        """Run the text encoder once for every planned card and return the embeddings.
+        
+        On CUDA the text encoder is then moved to the CPU, which frees its VRAM
+        for denoising. After that, cards must be generated from these embeddings.
+        """
+        print(f"📝 Encoding {len(plans)} prompts...")
+        embeds = []
+        with torch.no_grad():
+            for i in range(0, len(plans), self.batch_size):
+                prompts = [prompt for prompt, _, _ in plans[i:i + self.batch_size]]
+                chunk, _ = pipe.encode_prompt(prompt=prompts, do_classifier_free_guidance=False)
+                embeds.extend(chunk)
+        
+        # encode_prompt drops the padding, so each caption has its own length. Marked
+        # dynamic, a compiled denoiser traces that dimension once instead of per length.
+        for embed in embeds:
+            torch._dynamo.maybe_mark_dynamic(embed, 0)
+        
+        # With CPU offload enabled the offload hooks already take care of this
+        if self.device == "cuda" and not hasattr(pipe.text_encoder, "_hf_hook"):
+            pipe.text_encoder.to("cpu")
+            torch.cuda.empty_cache()
+        
+        return embeds
+    
+    def warm_up(self, pipe: ZImagePipeline, prompt_embeds: list):
+        """Two-step run on the first planned batch, at the real batch size and captions.
+        
+        The first step compiles and autotunes for those shapes, the second records
+        the CUDA graphs, so that batch's per-card time is representative. A smaller
+        tail batch still compiles once when it comes up.
+        """
+        print("🔥 Warming up...")
+        try:
+            pipe(prompt_embeds=prompt_embeds, height=self.height, width=self.width,
+                 num_inference_steps=2, guidance_scale=0.0, output_type="pt")
+        except torch.cuda.OutOfMemoryError:
+            # generate_all finds a batch size that fits
+            torch.cuda.empty_cache()
+    
+    def _seeded_generators(self, plans: list) -> list:
+        """Return one generator per planned card, seeded with card_seed()."""
+        while len(self._generators) < len(plans):
+            self._generators.append(torch.Generator(self.device))
+        return [gen.manual_seed(card_seed(filename))
+                for gen, (_, filename, _) in zip(self._generators, plans)]
+    
+    def generate_batch(self, pipe: ZImagePipeline, plans: list,
+                       prompt_embeds: Optional[list] = None) -> list:
+        """Generate several cards with a single pipeline call and return result info.
+        
+        Each card is seeded from its filename (card_seed), so results don't
+        depend on the batch size and a rerun replays failed cards exactly.
+        ``prompt_embeds`` (from encode_prompts) skips the text encoder.
+        """
         start = time.time()
         
+        if prompt_embeds is not None:
+            text_inputs = {"prompt_embeds": prompt_embeds}
+        else:
+            text_inputs = {"prompt": [prompt for prompt, _, _ in plans]}
+        
         try:
-            # Build prompt based on card type
-            if card_type == "joker":
-                joker_num = int(value)
-                prompt = build_joker_prompt(joker_num, self.theme, self.technique, self.background)
-                filename = f"ZZ_Joker_{value}_Joker{joker_num}.png"
-                display_name = f"Joker {joker_num}"
-            elif card_type == "back":
-                prompt = build_card_back_prompt(self.theme, self.technique, self.background)
-                filename = "ZZ_ZZ_00_Card-Back.png"
-                display_name = "Card Back"
-            else:
-                prompt = build_prompt(value, suit, self.theme, self.technique, self.background)
-                value_num = VALUE_ORDER[value]
-                filename = f"{suit}_{value_num}_{value}.png"
-                display_name = f"{value} of {suit}"
-            
-            output_path = self.output_dir / filename
-            
-            # Generate
-            generator = torch.Generator(self.device)
-            image = pipe(
-                prompt=prompt,
+            images = pipe(
+                **text_inputs,
                 height=self.height,
                 width=self.width,
                 num_inference_steps=self.steps,
                 guidance_scale=0.0,
-                generator=generator,
-            ).images[0]
-            
-            # Save
-            image.save(output_path)
-            
-            elapsed = time.time() - start
-            self.completed += 1
-            
-            result = {
-                "card": display_name,
-                "filename": filename,
-                "status": "success",
-                "time": f"{elapsed:.2f}s"
-            }
-            
-            # Progress bar
-            progress = (self.completed / self.total_cards) * 100
-            bar_length = 40
-            filled = int(bar_length * self.completed / self.total_cards)
-            bar = "█" * filled + "░" * (bar_length - filled)
-            
-            # Calculate ETA
-            if self.start_time:
-                elapsed_total = time.time() - self.start_time
-                avg_time = elapsed_total / self.completed
-                remaining = (self.total_cards - self.completed) * avg_time
-                eta = f"ETA: {int(remaining // 60)}m {int(remaining % 60)}s"
+                generator=self._seeded_generators(plans),
+                output_type="pt" if self._copy_stream is not None else "pil",
+            ).images
+            if self._copy_stream is not None:
+                saves = self._host_images(images)
             else:
-                eta = "Calculating..."
-            
-            print(f"[{bar}] {progress:5.1f}% | {self.completed}/{self.total_cards} | {display_name:20s} | {elapsed:5.2f}s | {eta}")
-            
-            return result
-            
+                saves = [image.save for image in images]
         except Exception as e:
-            self.failed += 1
-            print(f"❌ Failed to generate {display_name}: {e}")
-            return {
-                "card": display_name,
-                "filename": filename if 'filename' in locals() else "unknown",
-                "status": "failed",
-                "error": str(e)
-            }
+            if isinstance(e, torch.cuda.OutOfMemoryError) and len(plans) > 1:
+                raise  # generate_all retries with a smaller batch
+            failed = [self._failed_result(filename, display_name, e) for _, filename, display_name in plans]
+            for result in failed:
+                self._record(result)
+            return failed
+        
+        elapsed = (time.time() - start) / len(plans)
+        return [
+            self._save_result(save, filename, display_name, elapsed)
+            for save, (_, filename, display_name) in zip(saves, plans)
+        ]
+    
+    def generate_card(self, pipe: ZImagePipeline, value: str, suit: str, 
+                     card_type: str = "standard",
+                     prompt_embeds: Optional[torch.Tensor] = None) -> dict:
+        """Generate a single card and return result info."""
+        kinds = _KINDS_BY_CARD_TYPE[card_type]
+        entry = next(e for e in _CARD_PLAN if e[0] in kinds and e[1:3] == (value, suit))
+        previous = self._already_done(entry[3])
+        if previous is not None:
+            self._record(previous)
+            self.completed += 1
+            return previous
+        
+        embeds = [prompt_embeds] if prompt_embeds is not None else None
+        result = self.generate_batch(pipe, [self._plan_card(*entry)], embeds)[0]
+        self._finish_saves()
+        return result
     
     def generate_all(self, pipe: ZImagePipeline):
         """Generate all 55 cards in batch."""
@@ -252,28 +734,50 @@ class BatchGenerator:
         print(f"Output: {self.output_dir}")
         print(f"Device: {self.device.upper()}")
         print(f"Total Cards: {self.total_cards} (52 standard + 2 jokers + 1 back)")
+        print(f"Batch Size: {self.batch_size}")
         print("=" * 80)
         print()
         
         self.start_time = time.time()
         
-        # Generate standard cards (52)
-        print("📋 Generating standard cards (52)...")
-        for suit in SUITS:
-            for value in VALUES:
-                result = self.generate_card(pipe, value, suit, "standard")
-                self.results.append(result)
+        # Plan all cards: 52 standard, 2 jokers, 1 card back.
+        # Cards finished by a previous run of this deck are reused as-is.
+        plans = []
+        for entry in _CARD_PLAN:
+            previous = self._already_done(entry[3])
+            if previous is not None:
+                self._record(previous)
+                self.completed += 1
+            else:
+                plans.append(self._plan_card(*entry))
+        
+        if self.completed:
+            print(f"⏭️  Skipping {self.completed} cards from a previous run")
+        if not plans:
+            print("✅ Nothing to generate")
+        
+        embeds = self.encode_prompts(pipe, plans)
+        if self.device == "cuda" and plans:
+            self.warm_up(pipe, embeds[:self.batch_size])
         
-        # Generate jokers (2)
-        print("\n🃏 Generating jokers (2)...")
-        for joker_suit, joker_num, joker_name in JOKERS:
-            result = self.generate_card(pipe, joker_num, joker_suit, "joker")
-            self.results.append(result)
+        print(f"📋 Generating {len(plans)} cards...")
+        pbar = tqdm(total=len(plans), unit="card", smoothing=0.1, dynamic_ncols=True)
+        i = 0
+        while i < len(plans):
+            chunk = plans[i:i + self.batch_size]
+            pbar.set_postfix_str(chunk[0][2])
+            try:
+                self.generate_batch(pipe, chunk, prompt_embeds=embeds[i:i + len(chunk)])
+            except torch.cuda.OutOfMemoryError:
+                torch.cuda.empty_cache()
+                self.batch_size = max(1, self.batch_size // 2)
+                pbar.write(f"⚠️  Out of GPU memory, retrying with batch size {self.batch_size}")
+                continue
+            i += len(chunk)
+            pbar.update(len(chunk))
+        pbar.close()
         
-        # Generate card back (1)
-        print("\n🔙 Generating card back (1)...")
-        result = self.generate_card(pipe, "", "", "back")
-        self.results.append(result)
+        self._finish_saves()
         
         # Summary
         total_time = time.time() - self.start_time
@@ -293,8 +797,10 @@ class BatchGenerator:
         self.save_results(total_time)
     
     def save_results(self, total_time: float):
-        """Save batch results to JSON file."""
+        """Save the run summary to JSON, with the card list read back from the JSONL log."""
         results_file = self.output_dir / "batch_results.json"
+        recorded = self._read_results()
+        cards = [recorded[entry[3]] for entry in _CARD_PLAN if entry[3] in recorded]
         
         summary = {
             "timestamp": datetime.now().isoformat(),
@@ -302,12 +808,15 @@ class BatchGenerator:
             "technique": self.technique,
             "background": self.background,
             "device": self.device,
+            "height": self.height,
+            "width": self.width,
+            "steps": self.steps,
             "total_cards": self.total_cards,
             "completed": self.completed,
             "failed": self.failed,
             "total_time": f"{int(total_time // 60)}m {int(total_time % 60)}s",
             "avg_time_per_card": f"{total_time / self.completed:.2f}s" if self.completed > 0 else "N/A",
-            "cards": self.results
+            "cards": cards
         }
         
         with open(results_file, 'w') as f:
@@ -337,6 +846,18 @@ def main():
                        help="Number of inference steps")
     parser.add_argument("--device", type=str, choices=["cuda", "mps", "cpu"], 
                        default=None, help="Device to use (auto-detect if not specified)")
+    parser.add_argument("--batch-size", type=int, default=None, 
+                       help="Cards per pipeline call (default: 4 on CUDA, 1 otherwise; halved on OOM)")
+    parser.add_argument("--no-compile", action="store_true", 
+                       help="Disable torch.compile on CUDA (useful for debugging)")
+    parser.add_argument("--quantize", type=str, choices=QUANTIZE_MODES, default=None, 
+                       help="Quantize transformer weights on CUDA (8bit/4bit via bitsandbytes, fp8)")
+    parser.add_argument("--backend", type=str, choices=BACKENDS, default="torch", 
+                       help="Transformer backend (ort-cuda needs scripts/export_onnx.py first)")
+    parser.add_argument("--scheduler", type=str, choices=SCHEDULERS, default="default", 
+                       help="Sampler (unipc: higher-order solver for low step counts)")
+    parser.add_argument("--low-vram", action="store_true", 
+                       help="CPU-offload idle models on CUDA (for 8-16 GB GPUs)")
     
     args = parser.parse_args()
     
@@ -356,7 +877,9 @@ def main():
             return
     
     # Initialize pipeline
-    pipe = initialize_pipeline(device)
+    pipe = initialize_pipeline(device, compile_model=not args.no_compile, quantize=args.quantize,
+                               backend=args.backend, height=args.height, width=args.width,
+                               scheduler=args.scheduler, low_vram=args.low_vram)
     
     # Create batch generator
     generator = BatchGenerator(
@@ -367,7 +890,8 @@ def main():
         height=args.height,
         width=args.width,
         steps=args.steps,
-        device=device
+        device=device,
+        batch_size=args.batch_size or (4 if device == "cuda" else 1)
     )
     
     # Generate all cards
@@ -381,6 +905,8 @@ def main():
         print(f"\n\n❌ Error during generation: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        generator.close()
 
 
 if __name__ == "__main__":
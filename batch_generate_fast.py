@@ -9,7 +9,7 @@ from pathlib import Path
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from batch_generate import BatchGenerator, initialize_pipeline, get_device
+from batch_generate import BatchGenerator, initialize_pipeline, get_device, QUANTIZE_MODES, BACKENDS, SCHEDULERS
 
 def main():
     """Fast batch generation with reduced steps."""
@@ -30,6 +30,18 @@ def main():
                        help="Image width (reduced for speed)")
     parser.add_argument("--steps", type=int, default=4,     # Reduced from 9
                        help="Number of inference steps (reduced for speed)")
+    parser.add_argument("--batch-size", type=int, default=None, 
+                       help="Cards per pipeline call (default: 4 on CUDA, 1 otherwise; halved on OOM)")
+    parser.add_argument("--no-compile", action="store_true", 
+                       help="Disable torch.compile on CUDA (useful for debugging)")
+    parser.add_argument("--quantize", type=str, choices=QUANTIZE_MODES, default=None, 
+                       help="Quantize transformer weights on CUDA (8bit/4bit via bitsandbytes, fp8)")
+    parser.add_argument("--backend", type=str, choices=BACKENDS, default="torch", 
+                       help="Transformer backend (ort-cuda needs scripts/export_onnx.py first)")
+    parser.add_argument("--scheduler", type=str, choices=SCHEDULERS, default="unipc", 
+                       help="Sampler (unipc: higher-order solver for low step counts)")
+    parser.add_argument("--low-vram", action="store_true", 
+                       help="CPU-offload idle models on CUDA (for 8-16 GB GPUs)")
     
     args = parser.parse_args()
     
@@ -40,6 +52,7 @@ def main():
     print("⚠️  Settings optimized for SPEED over quality:")
     print(f"   • Image size: {args.width}x{args.height} (vs 640x1152)")
     print(f"   • Inference steps: {args.steps} (vs 9)")
+    print(f"   • Scheduler: {args.scheduler}")
     print(f"   • Expected time per card: ~8-12 minutes on Mac MPS")
     print(f"   • Total time for 55 cards: ~7-11 hours")
     print("=" * 60)
@@ -50,7 +63,9 @@ def main():
         return
     
     # Initialize pipeline
-    pipe = initialize_pipeline(device)
+    pipe = initialize_pipeline(device, compile_model=not args.no_compile, quantize=args.quantize,
+                               backend=args.backend, height=args.height, width=args.width,
+                               scheduler=args.scheduler, low_vram=args.low_vram)
     
     # Create batch generator
     generator = BatchGenerator(
@@ -61,7 +76,8 @@ def main():
         height=args.height,
         width=args.width,
         steps=args.steps,
-        device=device
+        device=device,
+        batch_size=args.batch_size or (4 if device == "cuda" else 1)
     )
     
     # Generate all cards
@@ -75,6 +91,8 @@ def main():
         print(f"\n\n❌ Error during generation: {e}")
         import traceback
         traceback.print_exc()
+    finally:
+        generator.close()
 
 
 if __name__ == "__main__":
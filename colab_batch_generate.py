@@ -6,21 +6,26 @@ Instructions:
 1. Go to https://colab.research.google.com/
 2. Create new notebook
 3. Runtime → Change runtime type → GPU → Save
-4. Copy this script to a cell and run
-5. Or upload this file and run: !python colab_batch_generate.py
+4. Upload this file together with batch_generate.py
+5. Run: !python colab_batch_generate.py
 """
 
 # Install dependencies (run this first in Colab)
 # !pip install torch diffusers transformers accelerate pillow
+# !pip install bitsandbytes  # only needed for QUANTIZE = "8bit" / "4bit"
 
 import torch
-from diffusers import ZImagePipeline
 from pathlib import Path
 import json
 import time
 from datetime import datetime
 import sys
 
+# batch_generate.py lives next to this file (or in the notebook's working directory)
+sys.path.insert(0, str(Path(__file__).parent if "__file__" in globals() else Path.cwd()))
+
+from batch_generate import initialize_pipeline
+
 # Card configuration
 SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
 VALUES = ["Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen", "King"]
@@ -109,9 +114,16 @@ def generate_full_deck(
     output_dir: str = "/content/cards",
     height: int = 1152,
     width: int = 640,
-    steps: int = 9
+    steps: int = 9,
+    quantize: str = None,
+    low_vram: bool = None
 ):
-    """Generate all 55 cards with Colab GPU."""
+    """Generate all 55 cards with Colab GPU.
+    
+    quantize: None, "8bit"/"4bit" (bitsandbytes) or "fp8" to shrink the
+    transformer weights, e.g. to fit a T4.
+    low_vram: CPU-offload idle models; None turns it on for GPUs under 16 GB.
+    """
     
     print("=" * 80)
     print("🎨 GOOGLE COLAB BATCH GENERATION")
@@ -131,76 +143,39 @@ def generate_full_deck(
     print(f"✅ GPU: {torch.cuda.get_device_name(0)}")
     print()
     
+    if low_vram is None:
+        low_vram = torch.cuda.get_device_properties(0).total_memory < 16 * 1024**3
+    
     # Create output directory
     output_path = Path(output_dir)
     output_path.mkdir(exist_ok=True, parents=True)
     
-    # Load pipeline
-    print("🔧 Loading Z-Image-Turbo pipeline...")
-    pipe = ZImagePipeline.from_pretrained(
-        "Tongyi-MAI/Z-Image-Turbo",
-        torch_dtype=torch.bfloat16,
-        low_cpu_mem_usage=False,
-    )
-    pipe.to("cuda")
-    print("✅ Pipeline ready!\n")
+    # Load pipeline (shared with batch_generate.py, so its optimizations apply here)
+    pipe = initialize_pipeline("cuda", quantize=quantize, height=height, width=width, low_vram=low_vram)
+    
+    # Plan all cards: 52 standard, 2 jokers, 1 card back
+    plans = [
+        (build_prompt(value, suit, theme, technique, background),
+         f"{suit}_{VALUE_ORDER[value]}_{value}.png", f"{value} of {suit}")
+        for suit in SUITS for value in VALUES
+    ]
+    plans += [
+        (build_joker_prompt(joker_num, theme, technique, background),
+         f"ZZ_Joker_{13+joker_num}_Joker{joker_num}.png", f"Joker {joker_num}")
+        for joker_num in [1, 2]
+    ]
+    plans.append((build_card_back_prompt(theme, technique, background), "ZZ_ZZ_00_Card-Back.png", "Card Back"))
     
     # Statistics
     start_time = time.time()
     completed = 0
-    total = 55
+    total = len(plans)
     results = []
     
-    # Generate standard cards (52)
-    print("📋 Generating standard cards (52)...")
-    for suit in SUITS:
-        for value in VALUES:
-            card_start = time.time()
-            
-            prompt = build_prompt(value, suit, theme, technique, background)
-            value_num = VALUE_ORDER[value]
-            filename = f"{suit}_{value_num}_{value}.png"
-            
-            try:
-                generator = torch.Generator("cuda")
-                image = pipe(
-                    prompt=prompt,
-                    height=height,
-                    width=width,
-                    num_inference_steps=steps,
-                    guidance_scale=0.0,
-                    generator=generator,
-                ).images[0]
-                
-                image.save(output_path / filename)
-                
-                elapsed = time.time() - card_start
-                completed += 1
-                
-                progress = (completed / total) * 100
-                bar_length = 40
-                filled = int(bar_length * completed / total)
-                bar = "█" * filled + "░" * (bar_length - filled)
-                
-                print(f"[{bar}] {progress:5.1f}% | {completed}/{total} | {value} of {suit:8s} | {elapsed:5.2f}s")
-                
-                results.append({
-                    "card": f"{value} of {suit}",
-                    "filename": filename,
-                    "status": "success",
-                    "time": f"{elapsed:.2f}s"
-                })
-            except Exception as e:
-                print(f"❌ Failed: {value} of {suit}: {e}")
-    
-    # Generate jokers (2)
-    print("\n🃏 Generating jokers (2)...")
-    for joker_num in [1, 2]:
+    print(f"📋 Generating {total} cards...")
+    for idx, (prompt, filename, display_name) in enumerate(plans, 1):
         card_start = time.time()
         
-        prompt = build_joker_prompt(joker_num, theme, technique, background)
-        filename = f"ZZ_Joker_{13+joker_num}_Joker{joker_num}.png"
-        
         try:
             generator = torch.Generator("cuda")
             image = pipe(
@@ -217,41 +192,21 @@ def generate_full_deck(
             elapsed = time.time() - card_start
             completed += 1
             
-            progress = (completed / total) * 100
+            progress = (idx / total) * 100
             bar_length = 40
-            filled = int(bar_length * completed / total)
+            filled = int(bar_length * idx / total)
             bar = "█" * filled + "░" * (bar_length - filled)
             
-            print(f"[{bar}] {progress:5.1f}% | {completed}/{total} | Joker {joker_num:14s} | {elapsed:5.2f}s")
+            print(f"[{bar}] {progress:5.1f}% | {completed}/{total} | {display_name:16s} | {elapsed:5.2f}s")
+            
+            results.append({
+                "card": display_name,
+                "filename": filename,
+                "status": "success",
+                "time": f"{elapsed:.2f}s"
+            })
         except Exception as e:
-            print(f"❌ Failed: Joker {joker_num}: {e}")
-    
-    # Generate card back (1)
-    print("\n🔙 Generating card back (1)...")
-    card_start = time.time()
-    
-    prompt = build_card_back_prompt(theme, technique, background)
-    filename = "ZZ_ZZ_00_Card-Back.png"
-    
-    try:
-        generator = torch.Generator("cuda")
-        image = pipe(
-            prompt=prompt,
-            height=height,
-            width=width,
-            num_inference_steps=steps,
-            guidance_scale=0.0,
-            generator=generator,
-        ).images[0]
-        
-        image.save(output_path / filename)
-        
-        elapsed = time.time() - card_start
-        completed += 1
-        
-        print(f"[{'█' * 40}] 100.0% | {completed}/{total} | Card Back        | {elapsed:5.2f}s")
-    except Exception as e:
-        print(f"❌ Failed: Card Back: {e}")
+            print(f"❌ Failed: {display_name}: {e}")
     
     # Summary
     total_time = time.time() - start_time
@@ -276,6 +231,12 @@ if __name__ == "__main__":
     TECHNIQUE = "Victorian engraving"
     BACKGROUND = "aged parchment"
     
+    # Weight quantization for small GPUs: None, "8bit", "4bit" or "fp8"
+    QUANTIZE = None
+    
+    # CPU offload: None = auto (on for GPUs under 16 GB, e.g. the free T4), True/False to force
+    LOW_VRAM = None
+    
     # For different themes, uncomment one:
     # THEME, TECHNIQUE, BACKGROUND = "Cyberpunk", "neon digital art", "dark holographic"
     # THEME, TECHNIQUE, BACKGROUND = "Art Nouveau", "flowing organic lines", "cream canvas"
@@ -288,5 +249,7 @@ if __name__ == "__main__":
         output_dir="/content/cards",
         height=1152,
         width=640,
-        steps=9
+        steps=9,
+        quantize=QUANTIZE,
+        low_vram=LOW_VRAM
     )
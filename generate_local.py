@@ -3,129 +3,457 @@ Local card generation using Z-Image-Turbo model
 This script generates playing card artwork locally using GPU acceleration.
 """
 
+from __future__ import annotations
+
+import os
+import shutil
+import hashlib
+import secrets
 import torch
-from diffusers import ZImagePipeline
+from PIL import Image
 from pathlib import Path
 import argparse
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from local_cards import SUITS, VALUES, CARD_FILENAMES, build_prompt, build_card_back_prompt
+
+# Fast FP32 matmuls on Ampere+ (TF32); harmless elsewhere
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+torch.set_float32_matmul_precision("high")
+# Shapes are fixed for a whole deck, so let cuDNN pick conv algorithms once
+torch.backends.cudnn.benchmark = True
+
+# diffusers is imported where the pipeline is built, so --help and --use-server stay fast
+if TYPE_CHECKING:
+    from diffusers import ZImagePipeline
 
-# Card configuration
-SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
-VALUES = ["Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen", "King"]
+# Turbo is guidance-distilled. At 0 ZImagePipeline turns classifier-free guidance off,
+# so it never encodes a negative prompt and the transformer sees one branch per card
+# instead of a doubled batch.
+GUIDANCE_SCALE = 0.0
 
-# Numeric order for file naming
-VALUE_ORDER = {
-    "Ace": "01", "2": "02", "3": "03", "4": "04", "5": "05",
-    "6": "06", "7": "07", "8": "08", "9": "09", "10": "10",
-    "Jack": "11", "Queen": "12", "King": "13"
-}
+MODEL_ID = "Tongyi-MAI/Z-Image-Turbo"
 
 
-def build_prompt(value: str, suit: str, theme: str, technique: str, background: str) -> str:
+def enable_block_cache(pipe: ZImagePipeline, interval: int) -> None:
     """
-    Build a prompt for generating card artwork.
+    Reuse transformer block outputs between denoising steps.
     
-    Args:
-        value: Card value (Ace, 2-10, Jack, Queen, King)
-        suit: Card suit (Hearts, Spades, Diamonds, Clubs)
-        theme: Visual theme for the deck
-        technique: Art technique/style
-        background: Background texture description
+    Only every ``interval``-th step runs the full transformer. On the other steps the
+    later two thirds of the blocks skip attention and MLP and add back the residual
+    they produced at the last full step. Early blocks always run since they are the
+    most sensitive to the timestep.
     
-    Returns:
-        Formatted prompt string
+    Args:
+        pipe: Initialized ZImagePipeline
+        interval: Recompute the cached blocks every N steps
     """
-    is_face_card = str(value).lower() in ['k', 'q', 'j', 'king', 'queen', 'jack']
+    layers = pipe.transformer.layers
+    residuals = {}
+    
+    def cached_forward(layer_id, block_forward):
+        def forward(x, *args, **kwargs):
+            # step_index is None until the scheduler's first step of each image
+            step = pipe.scheduler.step_index or 0
+            residual = residuals.get(layer_id)
+            if step % interval != 0 and residual is not None and residual.shape == x.shape:
+                return x + residual
+            out = block_forward(x, *args, **kwargs)
+            residuals[layer_id] = out - x
+            return out
+        return forward
+    
+    for block in layers[len(layers) // 3:]:
+        block.forward = cached_forward(block.layer_id, block.forward)
 
-    if is_face_card:
-        subject = f"A majestic portrait of a character representing the {value} of {suit}"
-        composition = "centered character bust, facing forward, vertical composition"
-    else:
-        subject = f"A symmetrical decorative arrangement of {value} distinct items representing {suit}"
-        composition = "objects arranged in a tight central cluster, vertical composition"
-
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
-**FORMAT:** Vertical Art Print (9:16 aspect ratio).
-
-**SUBJECT:**
-{subject}.
-The artwork must interpret the concept of "{value}" and "{suit}" using the visual language of {theme}.
-
-**COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed. No borders.
-- **Layout:** {composition}.
-- **Spacing:** Keep the important details clustered in the CENTER. Leave empty negative space around the edges (so it doesn't get cut off by a frame later).
-- **Style:** Detailed, high-contrast, clean lines.
-
-**NEGATIVE PROMPT:**
-- playing card, border, frame, corner text, numbers, letters, symbols, typography, zoomed out, table surface, 3d render, text, watermark.
-"""
 
+def cache_scheduler_timesteps(pipe: ZImagePipeline) -> None:
+    """
+    Memoize the scheduler's timestep schedule across pipe() calls.
+    
+    Every card uses the same step count and resolution, so the sigmas only need to be
+    built once. Later calls restore the cached tensors and reset the per-run step
+    counters, which is all set_timesteps does besides the computation.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+    """
+    from diffusers import FlowMatchEulerDiscreteScheduler
+    
+    scheduler = pipe.scheduler
+    if not isinstance(scheduler, FlowMatchEulerDiscreteScheduler):
+        return
+    
+    set_timesteps = scheduler.set_timesteps
+    schedules = {}
+    
+    def cached_set_timesteps(num_inference_steps=None, device=None, sigmas=None, mu=None, timesteps=None):
+        key = (
+            num_inference_steps,
+            str(device),
+            None if sigmas is None else tuple(sigmas),
+            mu,
+            None if timesteps is None else tuple(timesteps),
+        )
+        if key not in schedules:
+            set_timesteps(num_inference_steps=num_inference_steps, device=device, sigmas=sigmas, mu=mu, timesteps=timesteps)
+            schedules[key] = (scheduler.num_inference_steps, scheduler.timesteps, scheduler.sigmas)
+            return
+        scheduler.num_inference_steps, scheduler.timesteps, scheduler.sigmas = schedules[key]
+        scheduler._step_index = None
+        scheduler._begin_index = None
+    
+    scheduler.set_timesteps = cached_set_timesteps
 
-def build_card_back_prompt(theme: str, technique: str, background: str) -> str:
-    """Build prompt for card back design."""
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
-**FORMAT:** Vertical Art Print (9:16 aspect ratio).
 
-**SUBJECT:**
-A decorative card back design for a playing card deck. This is the BACK of the card, not the front.
-The design should be symmetrical, ornate, and reflect the {theme} theme.
+class GraphedVaeDecode:
+    """
+    Drop-in for ``vae.decode`` that replays a CUDA graph per latent shape.
+    
+    The first decode of each shape is captured after two warm-up runs; later decodes
+    copy the latents into the graph's static input and replay it. The returned image
+    tensor is the graph's static output, so it is overwritten by the next decode of
+    the same shape.
+    """
+    
+    def __init__(self, decode):
+        self.decode = decode
+        self.graphs = {}
+        self.last_stream = None
+    
+    def _capture(self, latents: torch.Tensor):
+        static_latents = latents.clone()
+        warmup = torch.cuda.Stream()
+        warmup.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(warmup):
+            for _ in range(2):
+                self.decode(static_latents, return_dict=False)
+        torch.cuda.current_stream().wait_stream(warmup)
+        
+        graph = torch.cuda.CUDAGraph()
+        # thread_local: the saver threads may wait on CUDA events during capture
+        with torch.cuda.graph(graph, capture_error_mode="thread_local"):
+            static_images = self.decode(static_latents, return_dict=False)[0]
+        return graph, static_latents, static_images
+    
+    def __call__(self, latents: torch.Tensor, return_dict: bool = True):
+        if return_dict:
+            return self.decode(latents, return_dict=True)
+        
+        key = (tuple(latents.shape), latents.dtype)
+        if key not in self.graphs:
+            self.graphs[key] = self._capture(latents)
+        graph, static_latents, static_images = self.graphs[key]
+        
+        # A decode queued on another stream may still be reading the static buffers
+        stream = torch.cuda.current_stream()
+        if self.last_stream is not None and self.last_stream != stream:
+            stream.wait_stream(self.last_stream)
+        self.last_stream = stream
+        
+        static_latents.copy_(latents)
+        graph.replay()
+        return (static_images,)
 
-**COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed.
-- **Layout:** Perfectly symmetrical design (180-degree rotational symmetry).
-- **Central Element:** An ornate medallion, crest, or decorative motif centered on the card.
-- **Border:** Intricate repeating pattern forming a decorative frame around the edges.
-- **Pattern:** Fill the space between the border and center with repeating {theme}-themed decorative elements.
-- **Style:** Detailed, high-contrast, clean lines, suitable for the back of playing cards.
 
-**NEGATIVE PROMPT:**
-- playing card faces, numbers, letters, asymmetrical design, text, watermark, 3d render.
-"""
+def select_attention_backend(pipe: ZImagePipeline) -> str:
+    """
+    Pick the fastest attention kernel the GPU supports.
+    
+    FlashAttention-3 on Hopper, FlashAttention-2 on Ampere/Ada, and xFormers on older
+    cards. Falls back to PyTorch SDPA if none of those are installed.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+    
+    Returns:
+        Name of the attention backend in use
+    """
+    major, _ = torch.cuda.get_device_capability()
+    if major >= 9:
+        candidates = ["_flash_3", "flash"]
+    elif major == 8:
+        candidates = ["flash"]
+    else:
+        candidates = ["xformers"]
+    
+    for backend in candidates:
+        try:
+            pipe.transformer.set_attention_backend(backend)
+            return backend
+        except Exception as e:
+            print(f"Attention backend '{backend}' not available: {e}")
+    
+    # SDPA picks its flash / memory-efficient kernels itself when they are allowed
+    torch.backends.cuda.enable_flash_sdp(True)
+    torch.backends.cuda.enable_mem_efficient_sdp(True)
+    pipe.transformer.set_attention_backend("native")
+    return "native"
 
 
-def initialize_pipeline(use_flash_attention: bool = False, compile_model: bool = False) -> ZImagePipeline:
+def initialize_pipeline(
+    use_flash_attention: bool = False,
+    compile_model: bool = False,
+    cache_interval: int = 1,
+    quantize: str = "none",
+    cuda_graph_vae: bool = False
+) -> ZImagePipeline:
     """
     Initialize the Z-Image pipeline with optimizations.
     
     Args:
         use_flash_attention: Enable Flash Attention for better efficiency
         compile_model: Compile the DiT model for faster inference (slower first run)
+        cache_interval: Recompute mid/late transformer blocks every N steps (1 = off)
+        quantize: Transformer weight quantization via torchao (none/int8/fp8)
+        cuda_graph_vae: Replay the VAE decode from CUDA graphs (costs VRAM per graph)
     
     Returns:
         Initialized ZImagePipeline
     """
+    from diffusers import ZImagePipeline
+    
     print("Loading Z-Image-Turbo pipeline...")
     
     # Load the pipeline
     pipe = ZImagePipeline.from_pretrained(
-        "Tongyi-MAI/Z-Image-Turbo",
+        MODEL_ID,
         torch_dtype=torch.bfloat16,
         low_cpu_mem_usage=False,
     )
     pipe.to("cuda")
     
+    # Optional: Weight-only quantization of the transformer's linear layers
+    if quantize != "none":
+        from torchao.quantization import quantize_, Int8WeightOnlyConfig, Float8WeightOnlyConfig
+        
+        print(f"Quantizing transformer weights to {quantize}...")
+        config = Int8WeightOnlyConfig() if quantize == "int8" else Float8WeightOnlyConfig()
+        quantize_(pipe.transformer, config)
+    
     # Optional: Flash Attention
     if use_flash_attention:
         print("Enabling Flash Attention...")
-        try:
-            pipe.transformer.set_attention_backend("flash")
-        except Exception as e:
-            print(f"Flash Attention not available: {e}")
+        backend = select_attention_backend(pipe)
+        print(f"Attention backend: {backend}")
+    
+    # Optional: Block caching
+    if cache_interval > 1:
+        print(f"Caching mid/late transformer blocks (full recompute every {cache_interval} steps)...")
+        enable_block_cache(pipe, cache_interval)
     
     # Optional: Model Compilation
     if compile_model:
         print("Compiling model (this will take a while on first run)...")
-        pipe.transformer.compile()
+        # Keep Inductor artifacts on disk so later runs skip most of the compile
+        os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", str(Path.home() / ".cache" / "deckgenai_inductor"))
+        torch._inductor.config.fx_graph_cache = True
+        torch._dynamo.config.cache_size_limit = 64
+        # Weights laid out for the conv/matmul kernels max-autotune picks from
+        if quantize == "none":
+            pipe.transformer.to(memory_format=torch.channels_last)
+        pipe.vae.to(memory_format=torch.channels_last)
+        # CUDA graphs reuse their output buffers on replay, which would clobber the
+        # residuals held by the block cache. No dynamic=False: caption lengths differ
+        # per card (see mark_caption_dynamic), and a --batch tail changes the batch size.
+        if cache_interval <= 1:
+            pipe.transformer.compile(mode="max-autotune", fullgraph=True)
+        else:
+            pipe.transformer.compile(mode="max-autotune-no-cudagraphs")
+    
+    # Optional: CUDA graph for the fixed-shape VAE decode
+    if cuda_graph_vae:
+        print("Decoding through CUDA graphs (captured on first use)...")
+        pipe.vae.decode = GraphedVaeDecode(pipe.vae.decode)
+    
+    cache_scheduler_timesteps(pipe)
+    
+    # The pipeline settings that change the pixels, for the image cache key
+    pipe.image_cache_settings = (MODEL_ID, quantize, cache_interval)
     
     print("Pipeline ready!")
     return pipe
 
 
+# zlib level for card PNGs: 1 encodes several times faster than Pillow's default 6
+# for a slightly larger file (still lossless)
+PNG_COMPRESS_LEVEL = 1
+
+# Finished cards from earlier runs, keyed by everything that determines the image
+IMAGE_CACHE_DIR = Path.home() / ".cache" / "deckgenai"
+
+
+def image_cache_path(
+    pipe: ZImagePipeline,
+    prompt: str,
+    seed: Optional[int],
+    num_inference_steps: int,
+    height: int,
+    width: int
+) -> Optional[Path]:
+    """
+    Cache location for a card, or None if it can't be reproduced exactly.
+    
+    The key covers the final prompt text plus the model, quantization and block
+    cache the pipeline was built with (``pipe.image_cache_settings``, set by
+    initialize_pipeline). Unseeded cards and pipelines built elsewhere aren't cached.
+    """
+    settings = getattr(pipe, "image_cache_settings", None)
+    if seed is None or settings is None:
+        return None
+    key = repr((settings, prompt, seed, num_inference_steps, height, width))
+    return IMAGE_CACHE_DIR / f"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}.png"
+
+
+def restore_cached_image(cache_path: Optional[Path], output_path: Path) -> bool:
+    """Copy a cached card to output_path. Returns False on a cache miss."""
+    if cache_path is None or not cache_path.exists():
+        return False
+    shutil.copy(cache_path, output_path)
+    print(f"Reused cached image for {output_path}")
+    return True
+
+
+def _store_in_cache(output_path: Path, cache_path: Optional[Path]) -> None:
+    """Keep a copy of a freshly saved card for later runs."""
+    if cache_path is not None:
+        cache_path.parent.mkdir(exist_ok=True, parents=True)
+        shutil.copy(output_path, cache_path)
+
+
+def save_image(
+    image,
+    output_path: Path,
+    saver: Optional[ThreadPoolExecutor] = None,
+    cache_path: Optional[Path] = None
+) -> None:
+    """Save an image, on a background thread when a saver pool is given."""
+    if saver is None:
+        image.save(output_path, compress_level=PNG_COMPRESS_LEVEL)
+        _store_in_cache(output_path, cache_path)
+        print(f"Saved to {output_path}")
+        return
+    
+    saver.submit(image.save, output_path, compress_level=PNG_COMPRESS_LEVEL).add_done_callback(_report_save(output_path, cache_path))
+
+
+def _report_save(output_path: Path, cache_path: Optional[Path] = None):
+    """Build a done-callback that reports how a background save went."""
+    def report(future):
+        if future.exception() is not None:
+            print(f"Failed to save {output_path}: {future.exception()}")
+        else:
+            _store_in_cache(output_path, cache_path)
+            print(f"Saved to {output_path}")
+    return report
+
+
+# Side stream for VAE decodes, created on first use
+_DECODE_STREAM = None
+
+
+def decode_and_save(
+    pipe: ZImagePipeline,
+    latents: torch.Tensor,
+    output_paths: list,
+    saver: ThreadPoolExecutor,
+    cache_paths: Optional[list] = None
+) -> None:
+    """
+    Decode latents on a side CUDA stream and save the images on the saver pool.
+    
+    Returns as soon as the work is queued, so the next card's denoising overlaps the
+    VAE. Each save waits on an event for its decode and host copy to finish.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+        latents: Denoised latents from pipe(..., output_type="latent")
+        output_paths: One output path per latent
+        saver: Thread pool the PNGs are written on
+        cache_paths: Image cache locations to copy each saved PNG to
+    """
+    global _DECODE_STREAM
+    if _DECODE_STREAM is None:
+        _DECODE_STREAM = torch.cuda.Stream()
+    
+    vae = pipe.vae
+    _DECODE_STREAM.wait_stream(torch.cuda.current_stream())
+    with torch.cuda.stream(_DECODE_STREAM), torch.inference_mode():
+        scaled = latents.to(vae.dtype) / vae.config.scaling_factor + vae.config.shift_factor
+        images = vae.decode(scaled, return_dict=False)[0]
+        # Same denormalization and rounding as the pipeline's PIL postprocessing
+        images = ((images / 2 + 0.5).clamp(0, 1).float() * 255).round().to(torch.uint8)
+        host = torch.empty(images.shape, dtype=torch.uint8, pin_memory=True)
+        host.copy_(images, non_blocking=True)
+        decoded = torch.cuda.Event()
+        decoded.record()
+    latents.record_stream(_DECODE_STREAM)
+    
+    def save(image, output_path):
+        decoded.synchronize()
+        Image.fromarray(image.permute(1, 2, 0).numpy()).save(output_path, compress_level=PNG_COMPRESS_LEVEL)
+    
+    if cache_paths is None:
+        cache_paths = [None] * len(output_paths)
+    for image, output_path, cache_path in zip(host, output_paths, cache_paths):
+        saver.submit(save, image, output_path).add_done_callback(_report_save(output_path, cache_path))
+
+
+# Prompt embeddings per (theme, technique, background), keyed by (value, suit)
+_PROMPT_EMBEDS_CACHE = {}
+
+
+def mark_caption_dynamic(embeds: list) -> list:
+    """
+    Mark the token dimension of caption embeddings as dynamic for torch.compile.
+    
+    encode_prompt drops the padding, so every card's caption has its own length.
+    Marked, a compiled transformer traces that dimension once instead of running a
+    fresh max-autotune compile for each new length. A no-op without compilation.
+    """
+    for embed in embeds:
+        torch._dynamo.maybe_mark_dynamic(embed, 0)
+    return embeds
+
+
+def encode_card_prompts(
+    pipe: ZImagePipeline,
+    cards: list,
+    theme: str,
+    technique: str,
+    background: str,
+    chunk_size: int = 8
+) -> dict:
+    """
+    Run the text encoder for a set of cards and cache the embeddings.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+        cards: List of (value, suit) pairs
+        theme: Visual theme
+        technique: Art technique
+        background: Background description
+        chunk_size: Prompts per text-encoder forward pass
+    
+    Returns:
+        Dict mapping (value, suit) to that card's prompt embedding
+    """
+    cache = _PROMPT_EMBEDS_CACHE.setdefault((theme, technique, background), {})
+    missing = [card for card in cards if card not in cache]
+    
+    for i in range(0, len(missing), chunk_size):
+        chunk = missing[i:i + chunk_size]
+        prompts = [build_prompt(value, suit, theme, technique, background) for value, suit in chunk]
+        with torch.inference_mode():
+            embeds, _ = pipe.encode_prompt(prompts, device="cuda", do_classifier_free_guidance=False)
+        cache.update(zip(chunk, mark_caption_dynamic(embeds)))
+    
+    return cache
+
+
 def generate_card(
     pipe: ZImagePipeline,
     value: str,
@@ -137,7 +465,9 @@ def generate_card(
     height: int = 1152,
     width: int = 640,
     num_inference_steps: int = 9,
-    seed: Optional[int] = None
+    seed: Optional[int] = None,
+    prompt_embeds: Optional[torch.Tensor] = None,
+    saver: Optional[ThreadPoolExecutor] = None
 ) -> Path:
     """
     Generate a single card image.
@@ -154,17 +484,27 @@ def generate_card(
         width: Image width (default 640 for 9:16 ratio)
         num_inference_steps: Number of diffusion steps
         seed: Random seed for reproducibility
+        prompt_embeds: Pre-computed embedding from encode_card_prompts
+        saver: Thread pool to encode the PNG on; the VAE decode then also runs on a
+            side stream, so the next card can start
     
     Returns:
         Path to saved image
     """
-    # Build prompt
+    # Generate filename
+    output_path = output_dir / CARD_FILENAMES[(value, suit)]
+    
+    # Same prompt, seed and pipeline settings as an earlier run: reuse that image
     prompt = build_prompt(value, suit, theme, technique, background)
+    cache_path = image_cache_path(pipe, prompt, seed, num_inference_steps, height, width)
+    if restore_cached_image(cache_path, output_path):
+        return output_path
     
-    # Generate filename
-    value_num = VALUE_ORDER[value]
-    filename = f"{suit}_{value_num}_{value}.png"
-    output_path = output_dir / filename
+    # Text-encode the prompt unless its embedding is already cached
+    if prompt_embeds is None:
+        prompt_kwargs = {"prompt": prompt}
+    else:
+        prompt_kwargs = {"prompt_embeds": [prompt_embeds]}
     
     print(f"Generating {value} of {suit}...")
     
@@ -173,23 +513,107 @@ def generate_card(
     if seed is not None:
         generator.manual_seed(seed)
     
-    # Generate image
-    image = pipe(
-        prompt=prompt,
+    # Generate image (latents only when the VAE decode can run in the background)
+    output = pipe(
+        **prompt_kwargs,
         height=height,
         width=width,
         num_inference_steps=num_inference_steps,
-        guidance_scale=0.0,  # Guidance should be 0 for Turbo models
+        guidance_scale=GUIDANCE_SCALE,
         generator=generator,
-    ).images[0]
+        output_type="pil" if saver is None else "latent",
+    ).images
     
     # Save image
-    image.save(output_path)
-    print(f"Saved to {output_path}")
+    if saver is None:
+        save_image(output[0], output_path, saver, cache_path)
+    else:
+        decode_and_save(pipe, output, [output_path], saver, [cache_path])
     
     return output_path
 
 
+def generate_cards_batch(
+    pipe: ZImagePipeline,
+    cards: list,
+    output_dir: Path,
+    theme: str = "Western Steampunk",
+    technique: str = "Victorian engraving",
+    background: str = "aged parchment",
+    height: int = 1152,
+    width: int = 640,
+    num_inference_steps: int = 9,
+    seed: Optional[int] = None,
+    prompt_embeds: Optional[dict] = None,
+    saver: Optional[ThreadPoolExecutor] = None
+) -> list:
+    """
+    Generate several cards with a single pipeline call.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+        cards: List of (value, suit) pairs
+        output_dir: Directory to save images
+        theme: Visual theme
+        technique: Art technique
+        background: Background description
+        height: Image height
+        width: Image width
+        num_inference_steps: Number of diffusion steps
+        seed: Base random seed; card k of the batch uses seed + k
+        prompt_embeds: Embeddings from encode_card_prompts, keyed by (value, suit)
+        saver: Thread pool to encode the PNGs on; the VAE decode then also runs on a
+            side stream, so the next batch can start
+    
+    Returns:
+        Paths to saved images, in the order of ``cards``
+    """
+    output_paths = [output_dir / CARD_FILENAMES[card] for card in cards]
+    seeds = [None if seed is None else seed + k for k in range(len(cards))]
+    prompts = [build_prompt(value, suit, theme, technique, background) for value, suit in cards]
+    cache_paths = [
+        image_cache_path(pipe, prompt, card_seed, num_inference_steps, height, width)
+        for prompt, card_seed in zip(prompts, seeds)
+    ]
+    
+    # Only cards without a cached image go through the pipeline
+    todo = [k for k in range(len(cards)) if not restore_cached_image(cache_paths[k], output_paths[k])]
+    if not todo:
+        return output_paths
+    
+    if prompt_embeds is None:
+        prompt_kwargs = {"prompt": [prompts[k] for k in todo]}
+    else:
+        prompt_kwargs = {"prompt_embeds": [prompt_embeds[cards[k]] for k in todo]}
+    
+    print(f"Generating {', '.join('{} of {}'.format(*cards[k]) for k in todo)}...")
+    
+    generators = []
+    for k in todo:
+        generator = torch.Generator("cuda")
+        if seeds[k] is not None:
+            generator.manual_seed(seeds[k])
+        generators.append(generator)
+    
+    images = pipe(
+        **prompt_kwargs,
+        height=height,
+        width=width,
+        num_inference_steps=num_inference_steps,
+        guidance_scale=GUIDANCE_SCALE,
+        generator=generators,
+        output_type="pil" if saver is None else "latent",
+    ).images
+    
+    if saver is None:
+        for k, image in zip(todo, images):
+            save_image(image, output_paths[k], saver, cache_paths[k])
+    else:
+        decode_and_save(pipe, images, [output_paths[k] for k in todo], saver, [cache_paths[k] for k in todo])
+    
+    return output_paths
+
+
 def generate_card_back(
     pipe: ZImagePipeline,
     output_dir: Path,
@@ -199,10 +623,15 @@ def generate_card_back(
     height: int = 1152,
     width: int = 640,
     num_inference_steps: int = 9,
-    seed: Optional[int] = None
+    seed: Optional[int] = None,
+    saver: Optional[ThreadPoolExecutor] = None,
+    prompt_embeds: Optional[torch.Tensor] = None
 ) -> Path:
     """Generate card back design."""
-    prompt = build_card_back_prompt(theme, technique, background)
+    if prompt_embeds is None:
+        prompt_kwargs = {"prompt": build_card_back_prompt(theme, technique, background)}
+    else:
+        prompt_kwargs = {"prompt_embeds": [prompt_embeds]}
     
     filename = "ZZ_00_Card-Back.png"
     output_path = output_dir / filename
@@ -214,20 +643,116 @@ def generate_card_back(
         generator.manual_seed(seed)
     
     image = pipe(
-        prompt=prompt,
+        **prompt_kwargs,
         height=height,
         width=width,
         num_inference_steps=num_inference_steps,
-        guidance_scale=0.0,
+        guidance_scale=GUIDANCE_SCALE,
         generator=generator,
     ).images[0]
     
-    image.save(output_path)
-    print(f"Saved to {output_path}")
+    save_image(image, output_path, saver)
     
     return output_path
 
 
+# Local generation server. Requests and replies are pickled, so only connections that
+# know the key are accepted; the key is random and readable by this user only.
+SERVER_HOST = "localhost"
+SERVER_KEY_PATH = IMAGE_CACHE_DIR / "server.key"
+
+
+def _server_authkey(create: bool = False) -> Optional[bytes]:
+    """The --serve key from SERVER_KEY_PATH, generated on the first --serve if ``create``."""
+    if create and not SERVER_KEY_PATH.exists():
+        SERVER_KEY_PATH.parent.mkdir(exist_ok=True, parents=True)
+        # O_EXCL + 0600: never reuse a file someone else planted or could read
+        fd = os.open(SERVER_KEY_PATH, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+        with os.fdopen(fd, "wb") as f:
+            f.write(secrets.token_bytes(32))
+    try:
+        return SERVER_KEY_PATH.read_bytes()
+    except FileNotFoundError:
+        return None
+
+
+def serve(pipe: ZImagePipeline, port: int) -> None:
+    """
+    Keep the pipeline loaded and generate cards for clients until interrupted.
+    
+    Each request is a dict of generate_card / generate_card_back keyword arguments
+    plus ``output_dir`` (and ``value``/``suit``, or ``card_back=True``). The reply is
+    the saved path as a string, or ``{"error": message}``.
+    
+    Args:
+        pipe: Initialized ZImagePipeline
+        port: TCP port to listen on (localhost only)
+    """
+    with Listener((SERVER_HOST, port), authkey=_server_authkey(create=True)) as listener:
+        print(f"Serving on {SERVER_HOST}:{port} (Ctrl+C to stop)...")
+        while True:
+            # A client with the wrong key, or one that hangs up mid-handshake, only
+            # loses its own connection
+            try:
+                conn = listener.accept()
+            except (AuthenticationError, EOFError, OSError) as e:
+                print(f"Rejected connection: {e!r}")
+                continue
+            
+            with conn:
+                try:
+                    request = conn.recv()
+                except Exception as e:
+                    print(f"Dropped malformed request: {e!r}")
+                    continue
+                
+                try:
+                    output_dir = Path(request.pop("output_dir"))
+                    output_dir.mkdir(exist_ok=True, parents=True)
+                    if request.pop("card_back", False):
+                        path = generate_card_back(pipe, output_dir, **request)
+                    else:
+                        path = generate_card(pipe, request.pop("value"), request.pop("suit"), output_dir, **request)
+                    reply = str(path)
+                except Exception as e:
+                    print(f"Request failed: {e}")
+                    reply = {"error": str(e)}
+                
+                try:
+                    conn.send(reply)
+                except OSError:
+                    print("Client went away before the reply")
+
+
+def request_from_server(request: dict, port: int) -> Optional[str]:
+    """
+    Have a running ``--serve`` process generate one card.
+    
+    Args:
+        request: Request dict as described in serve()
+        port: Port the server listens on
+    
+    Returns:
+        Path of the saved image, or None if no server is listening (or none has
+        ever been started by this user)
+    """
+    authkey = _server_authkey()
+    if authkey is None:
+        return None
+    try:
+        conn = Client((SERVER_HOST, port), authkey=authkey)
+    except ConnectionRefusedError:
+        return None
+    
+    with conn:
+        conn.send(request)
+        reply = conn.recv()
+    if isinstance(reply, dict):
+        raise RuntimeError(reply["error"])
+    return reply
+
+
+@torch.inference_mode()
 def main():
     """Main execution function."""
     parser = argparse.ArgumentParser(description="Generate playing card artwork locally using Z-Image-Turbo")
@@ -241,29 +766,71 @@ def main():
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducibility")
     parser.add_argument("--flash-attention", action="store_true", help="Enable Flash Attention")
     parser.add_argument("--compile", action="store_true", help="Compile model for faster inference")
+    parser.add_argument("--quantize", type=str, choices=["none", "int8", "fp8"], default="none", help="Quantize transformer weights with torchao (fp8 needs Ada/Hopper)")
+    parser.add_argument("--cuda-graph-vae", action="store_true", help="Replay the VAE decode from a CUDA graph (uses extra VRAM)")
+    parser.add_argument("--cache-interval", type=int, default=1, help="Recompute mid/late transformer blocks every N steps (1 = off)")
     parser.add_argument("--single-card", nargs=2, metavar=("VALUE", "SUIT"), help="Generate a single card (e.g., --single-card Ace Hearts)")
     parser.add_argument("--card-back", action="store_true", help="Generate only the card back")
     parser.add_argument("--full-deck", action="store_true", help="Generate all 52 cards plus back")
+    parser.add_argument("--batch", type=int, default=1, help="Cards per pipeline call for --full-deck (falls back to 1 on failure)")
+    parser.add_argument("--serve", action="store_true", help="Keep the pipeline loaded and serve --use-server requests")
+    parser.add_argument("--use-server", action="store_true", help="Send --single-card/--card-back to a running --serve process")
+    parser.add_argument("--port", type=int, default=6007, help="Port for --serve and --use-server")
     
     args = parser.parse_args()
     
+    # Anything else would quietly load a second pipeline next to the server's
+    if args.use_server and not (args.single_card or args.card_back):
+        parser.error("--use-server only sends --single-card / --card-back requests; "
+                     "--full-deck loads its own pipeline, so stop the server first or run it without --use-server")
+    
+    if args.single_card:
+        value, suit = args.single_card
+        if value not in VALUES or suit not in SUITS:
+            print(f"Error: Invalid card. Value must be in {VALUES}, Suit must be in {SUITS}")
+            return
+    
     # Create output directory
     output_dir = Path(args.output_dir)
     output_dir.mkdir(exist_ok=True, parents=True)
     
+    # Hand single cards to a warm server instead of loading the pipeline here
+    if args.use_server and (args.single_card or args.card_back):
+        request = {
+            "output_dir": str(output_dir.resolve()),
+            "theme": args.theme,
+            "technique": args.technique,
+            "background": args.background,
+            "height": args.height,
+            "width": args.width,
+            "num_inference_steps": args.steps,
+            "seed": args.seed,
+        }
+        if args.single_card:
+            request.update(value=value, suit=suit)
+        else:
+            request["card_back"] = True
+        
+        path = request_from_server(request, args.port)
+        if path is not None:
+            print(f"Saved to {path}")
+            return
+        print(f"No server on port {args.port}, loading the pipeline locally...")
+    
     # Initialize pipeline
     pipe = initialize_pipeline(
         use_flash_attention=args.flash_attention,
-        compile_model=args.compile
+        compile_model=args.compile,
+        cache_interval=args.cache_interval,
+        quantize=args.quantize,
+        cuda_graph_vae=args.cuda_graph_vae
     )
     
     # Generate based on mode
-    if args.single_card:
-        value, suit = args.single_card
-        if value not in VALUES or suit not in SUITS:
-            print(f"Error: Invalid card. Value must be in {VALUES}, Suit must be in {SUITS}")
-            return
-        
+    if args.serve:
+        serve(pipe, args.port)
+    
+    elif args.single_card:
         generate_card(
             pipe, value, suit, output_dir,
             theme=args.theme,
@@ -290,9 +857,52 @@ def main():
     elif args.full_deck:
         print("Generating full deck (52 cards + back)...")
         
-        # Generate all cards
-        for suit in SUITS:
-            for value in VALUES:
+        # Generate all cards, args.batch at a time. Value-major order keeps prompts that
+        # differ only by suit next to each other and the face cards in one run at the end.
+        cards = [(value, suit) for value in VALUES for suit in SUITS]
+        batch = max(1, args.batch)
+        
+        # PNG encoding runs here while the GPU moves on to the next card
+        saver = ThreadPoolExecutor(max_workers=2)
+        
+        # Encode every card prompt up front instead of once per pipe() call
+        embeds = encode_card_prompts(pipe, cards, args.theme, args.technique, args.background)
+        with torch.inference_mode():
+            back_embeds, _ = pipe.encode_prompt(
+                [build_card_back_prompt(args.theme, args.technique, args.background)],
+                device="cuda",
+                do_classifier_free_guidance=False,
+            )
+        mark_caption_dynamic(back_embeds)
+        
+        # Nothing else needs the text encoder, so give its VRAM to the denoiser
+        pipe.text_encoder.to("cpu")
+        torch.cuda.empty_cache()
+        
+        for i in range(0, len(cards), batch):
+            chunk = cards[i:i + batch]
+            if batch > 1:
+                try:
+                    generate_cards_batch(
+                        pipe, chunk, output_dir,
+                        theme=args.theme,
+                        technique=args.technique,
+                        background=args.background,
+                        height=args.height,
+                        width=args.width,
+                        num_inference_steps=args.steps,
+                        seed=None if args.seed is None else args.seed + i,
+                        prompt_embeds=embeds,
+                        saver=saver
+                    )
+                    continue
+                except Exception as e:
+                    print(f"Batched generation failed ({e}), continuing one card at a time")
+                    torch.cuda.empty_cache()
+                    batch = 1
+            
+            # Same per-position seed as the batched path, so --batch never changes a card
+            for k, (value, suit) in enumerate(chunk):
                 generate_card(
                     pipe, value, suit, output_dir,
                     theme=args.theme,
@@ -301,7 +911,9 @@ def main():
                     height=args.height,
                     width=args.width,
                     num_inference_steps=args.steps,
-                    seed=args.seed
+                    seed=None if args.seed is None else args.seed + i + k,
+                    prompt_embeds=embeds[(value, suit)],
+                    saver=saver
                 )
         
         # Generate card back
@@ -313,8 +925,11 @@ def main():
             height=args.height,
             width=args.width,
             num_inference_steps=args.steps,
-            seed=args.seed
+            seed=args.seed,
+            saver=saver,
+            prompt_embeds=back_embeds[0]
         )
+        saver.shutdown(wait=True)
         
         print("\nFull deck generation complete!")
     
@@ -323,6 +938,7 @@ def main():
         print("  --single-card VALUE SUIT : Generate one card")
         print("  --card-back             : Generate card back only")
         print("  --full-deck             : Generate all 52 cards + back")
+        print("  --serve                 : Keep the pipeline loaded for --use-server requests")
         parser.print_help()
 
 
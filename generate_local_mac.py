@@ -3,27 +3,31 @@ Local card generation adapted for Mac (CPU/MPS)
 This version works on Macs without NVIDIA GPU by using CPU or Apple Silicon's MPS.
 """
 
+from __future__ import annotations
+
+import os
+import functools
 import torch
-from diffusers import ZImagePipeline
 from pathlib import Path
 import argparse
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 import platform
 
-# Card configuration
-SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
-VALUES = ["Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen", "King"]
+from local_cards import SUITS, VALUES, VALUE_ORDER, build_prompt, build_card_back_prompt
 
-# Numeric order for file naming
-VALUE_ORDER = {
-    "Ace": "01", "2": "02", "3": "03", "4": "04", "5": "05",
-    "6": "06", "7": "07", "8": "08", "9": "09", "10": "10",
-    "Jack": "11", "Queen": "12", "King": "13"
-}
+# diffusers is imported where the pipeline is built, so --help stays fast
+if TYPE_CHECKING:
+    from diffusers import ZImagePipeline
 
 
+@functools.lru_cache(maxsize=1)
 def get_device():
-    """Detect the best available device."""
+    """Detect the best available device (probed once; DECKGENAI_FORCE_DEVICE skips the probe)."""
+    forced = os.environ.get("DECKGENAI_FORCE_DEVICE")
+    if forced:
+        if forced not in ("cuda", "mps", "cpu"):
+            raise ValueError(f"DECKGENAI_FORCE_DEVICE must be cuda, mps or cpu, not {forced!r}")
+        return forced
     if torch.cuda.is_available():
         return "cuda"
     elif hasattr(torch.backends, 'mps') and torch.backends.mps.is_available():
@@ -32,71 +36,32 @@ def get_device():
         return "cpu"
 
 
-def build_prompt(value: str, suit: str, theme: str, technique: str, background: str) -> str:
-    """Build a prompt for generating card artwork."""
-    is_face_card = str(value).lower() in ['k', 'q', 'j', 'king', 'queen', 'jack']
-
-    if is_face_card:
-        subject = f"A majestic portrait of a character representing the {value} of {suit}"
-        composition = "centered character bust, facing forward, vertical composition"
-    else:
-        subject = f"A symmetrical decorative arrangement of {value} distinct items representing {suit}"
-        composition = "objects arranged in a tight central cluster, vertical composition"
-
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
-**FORMAT:** Vertical Art Print (9:16 aspect ratio).
-
-**SUBJECT:**
-{subject}.
-The artwork must interpret the concept of "{value}" and "{suit}" using the visual language of {theme}.
-
-**COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed. No borders.
-- **Layout:** {composition}.
-- **Spacing:** Keep the important details clustered in the CENTER. Leave empty negative space around the edges (so it doesn't get cut off by a frame later).
-- **Style:** Detailed, high-contrast, clean lines.
-
-**NEGATIVE PROMPT:**
-- playing card, border, frame, corner text, numbers, letters, symbols, typography, zoomed out, table surface, 3d render, text, watermark.
-"""
-
-
-def build_card_back_prompt(theme: str, technique: str, background: str) -> str:
-    """Build prompt for card back design."""
-    return f"""
-**ART STYLE:** {technique}.
-**THEME:** {theme}.
-**FORMAT:** Vertical Art Print (9:16 aspect ratio).
-
-**SUBJECT:**
-A decorative card back design for a playing card deck. This is the BACK of the card, not the front.
-The design should be symmetrical, ornate, and reflect the {theme} theme.
-
-**COMPOSITION RULES:**
-- **Background:** {background} texture. Full bleed.
-- **Layout:** Perfectly symmetrical design (180-degree rotational symmetry).
-- **Central Element:** An ornate medallion, crest, or decorative motif centered on the card.
-- **Border:** Intricate repeating pattern forming a decorative frame around the edges.
-- **Pattern:** Fill the space between the border and center with repeating {theme}-themed decorative elements.
-- **Style:** Detailed, high-contrast, clean lines, suitable for the back of playing cards.
-
-**NEGATIVE PROMPT:**
-- playing card faces, numbers, letters, asymmetrical design, text, watermark, 3d render.
-"""
+def _fits_in_mps_memory(pipe: ZImagePipeline) -> bool:
+    """Check whether the whole pipeline fits in Metal's recommended working set."""
+    if not hasattr(torch.mps, "recommended_max_memory"):
+        return False
+    weight_bytes = sum(
+        p.numel() * p.element_size()
+        for component in (pipe.text_encoder, pipe.transformer, pipe.vae)
+        for p in component.parameters()
+    )
+    # Leave headroom for activations and the decoded image
+    return weight_bytes + 2 * 1024**3 <= torch.mps.recommended_max_memory()
 
 
-def initialize_pipeline(device: str = None) -> ZImagePipeline:
+def initialize_pipeline(device: str = None, compile_model: bool = False) -> ZImagePipeline:
     """
     Initialize the Z-Image pipeline.
     
     Args:
         device: Target device (cuda/mps/cpu). If None, auto-detect.
+        compile_model: Compile the transformer (aot_eager on MPS, slower first run)
     
     Returns:
         Initialized ZImagePipeline
     """
+    from diffusers import ZImagePipeline
+    
     if device is None:
         device = get_device()
     
@@ -117,13 +82,24 @@ def initialize_pipeline(device: str = None) -> ZImagePipeline:
         low_cpu_mem_usage=True,
     )
     
-    # Move to device
+    # ZImagePipeline decodes in vae.dtype and never consults force_upcast, so the VAE
+    # already runs in fp16 here; pin that so nothing upcasts it to fp32 later
     if device == "mps":
-        # MPS has some quirks, use enable_model_cpu_offload for better compatibility
+        pipe.vae.register_to_config(force_upcast=False)
+    
+    # Move to device
+    if device == "mps" and not _fits_in_mps_memory(pipe):
+        # Not enough unified memory to keep everything resident
+        print("Pipeline exceeds the MPS working set, using CPU offload...")
         pipe.enable_model_cpu_offload()
     else:
         pipe.to(device)
     
+    # Optional: Model Compilation (Inductor doesn't support MPS; aot_eager still cuts Python overhead)
+    if compile_model:
+        print("Compiling model (this will take a while on first run)...")
+        pipe.transformer.compile(backend="aot_eager" if device == "mps" else "inductor")
+    
     print(f"Pipeline ready on {device.upper()}!")
     if device == "cpu":
         print("⚠️  Note: CPU generation is very slow. Consider using a GPU cloud service.")
@@ -235,6 +211,7 @@ def main():
     parser.add_argument("--steps", type=int, default=9, help="Number of inference steps")
     parser.add_argument("--seed", type=int, default=None, help="Random seed for reproducibility")
     parser.add_argument("--device", type=str, choices=["cuda", "mps", "cpu"], default=None, help="Device to use (auto-detect if not specified)")
+    parser.add_argument("--compile", action="store_true", help="Compile model for faster inference")
     parser.add_argument("--single-card", nargs=2, metavar=("VALUE", "SUIT"), help="Generate a single card (e.g., --single-card Ace Hearts)")
     parser.add_argument("--card-back", action="store_true", help="Generate only the card back")
     parser.add_argument("--full-deck", action="store_true", help="Generate all 52 cards plus back")
@@ -253,7 +230,7 @@ def main():
     output_dir.mkdir(exist_ok=True, parents=True)
     
     # Initialize pipeline
-    pipe = initialize_pipeline(device)
+    pipe = initialize_pipeline(device, compile_model=args.compile)
     
     # Generate based on mode
     if args.single_card:
@@ -0,0 +1,95 @@
+"""
+Card tables and prompt builders shared by generate_local.py and generate_local_mac.py
+Kept free of torch/diffusers imports so it loads instantly.
+"""
+
+from functools import lru_cache
+
+# Card configuration
+SUITS = ["Hearts", "Spades", "Diamonds", "Clubs"]
+VALUES = ["Ace", "2", "3", "4", "5", "6", "7", "8", "9", "10", "Jack", "Queen", "King"]
+
+# Numeric order for file naming
+VALUE_ORDER = {
+    "Ace": "01", "2": "02", "3": "03", "4": "04", "5": "05",
+    "6": "06", "7": "07", "8": "08", "9": "09", "10": "10",
+    "Jack": "11", "Queen": "12", "King": "13"
+}
+
+# Values drawn as character portraits (full names and single-letter shorthand)
+FACE_CARDS = frozenset({"jack", "queen", "king", "j", "q", "k"})
+
+# Output filename for every card, sorted by suit then value
+CARD_FILENAMES = {
+    (value, suit): f"{suit}_{VALUE_ORDER[value]}_{value}.png"
+    for suit in SUITS for value in VALUES
+}
+
+
+@lru_cache(maxsize=256)
+def build_prompt(value: str, suit: str, theme: str, technique: str, background: str) -> str:
+    """
+    Build a prompt for generating card artwork.
+    
+    Args:
+        value: Card value (Ace, 2-10, Jack, Queen, King)
+        suit: Card suit (Hearts, Spades, Diamonds, Clubs)
+        theme: Visual theme for the deck
+        technique: Art technique/style
+        background: Background texture description
+    
+    Returns:
+        Formatted prompt string
+    """
+    is_face_card = str(value).lower() in FACE_CARDS
+
+    if is_face_card:
+        subject = f"A majestic portrait of a character representing the {value} of {suit}"
+        composition = "centered character bust, facing forward, vertical composition"
+    else:
+        subject = f"A symmetrical decorative arrangement of {value} distinct items representing {suit}"
+        composition = "objects arranged in a tight central cluster, vertical composition"
+
+    return f"""
+**ART STYLE:** {technique}.
+**THEME:** {theme}.
+**FORMAT:** Vertical Art Print (9:16 aspect ratio).
+
+**SUBJECT:**
+{subject}.
+The artwork must interpret the concept of "{value}" and "{suit}" using the visual language of {theme}.
+
+**COMPOSITION RULES:**
+- **Background:** {background} texture. Full bleed. No borders.
+- **Layout:** {composition}.
+- **Spacing:** Keep the important details clustered in the CENTER. Leave empty negative space around the edges (so it doesn't get cut off by a frame later).
+- **Style:** Detailed, high-contrast, clean lines.
+
+**NEGATIVE PROMPT:**
+- playing card, border, frame, corner text, numbers, letters, symbols, typography, zoomed out, table surface, 3d render, text, watermark.
+"""
+
+
+@lru_cache(maxsize=16)
+def build_card_back_prompt(theme: str, technique: str, background: str) -> str:
+    """Build prompt for card back design."""
+    return f"""
+**ART STYLE:** {technique}.
+**THEME:** {theme}.
+**FORMAT:** Vertical Art Print (9:16 aspect ratio).
+
+**SUBJECT:**
+A decorative card back design for a playing card deck. This is the BACK of the card, not the front.
+The design should be symmetrical, ornate, and reflect the {theme} theme.
+
+**COMPOSITION RULES:**
+- **Background:** {background} texture. Full bleed.
+- **Layout:** Perfectly symmetrical design (180-degree rotational symmetry).
+- **Central Element:** An ornate medallion, crest, or decorative motif centered on the card.
+- **Border:** Intricate repeating pattern forming a decorative frame around the edges.
+- **Pattern:** Fill the space between the border and center with repeating {theme}-themed decorative elements.
+- **Style:** Detailed, high-contrast, clean lines, suitable for the back of playing cards.
+
+**NEGATIVE PROMPT:**
+- playing card faces, numbers, letters, asymmetrical design, text, watermark, 3d render.
+"""
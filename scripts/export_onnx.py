@@ -0,0 +1,89 @@
+"""
+Export the Z-Image-Turbo transformer to ONNX for the ort-cuda backend
+Run once per resolution; batch_generate.py --backend ort-cuda picks the file up
+"""
+
+import sys
+from pathlib import Path
+
+import torch
+from diffusers import ZImageTransformer2DModel
+
+# Add repo root to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from batch_generate import onnx_transformer_path
+
+
+class TransformerExportWrapper(torch.nn.Module):
+    """Single-latent tensor interface around the list-based transformer forward."""
+
+    def __init__(self, transformer: ZImageTransformer2DModel):
+        super().__init__()
+        self.transformer = transformer
+
+    def forward(self, latent: torch.Tensor, timestep: torch.Tensor, cap_feats: torch.Tensor) -> torch.Tensor:
+        return self.transformer([latent], timestep, [cap_feats], return_dict=False)[0][0]
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Export the Z-Image transformer to ONNX")
+    parser.add_argument("--height", type=int, default=1152,
+                       help="Image height the graph is built for")
+    parser.add_argument("--width", type=int, default=640,
+                       help="Image width the graph is built for")
+    parser.add_argument("--force", action="store_true",
+                       help="Re-export even if the ONNX file already exists")
+
+    args = parser.parse_args()
+
+    if not torch.cuda.is_available():
+        print("❌ CUDA GPU not available!")
+        return
+
+    onnx_path = onnx_transformer_path(args.height, args.width)
+    if onnx_path.exists() and not args.force:
+        print(f"✅ Already exported: {onnx_path}")
+        return
+    onnx_path.parent.mkdir(exist_ok=True, parents=True)
+
+    print("🔧 Loading Z-Image-Turbo transformer (fp16)...")
+    transformer = ZImageTransformer2DModel.from_pretrained(
+        "Tongyi-MAI/Z-Image-Turbo",
+        subfolder="transformer",
+        torch_dtype=torch.float16,
+    ).to("cuda").eval()
+
+    # Same latent geometry as ZImagePipeline.prepare_latents (VAE downsamples 8x)
+    config = transformer.config
+    latent = torch.randn(config.in_channels, 1, args.height // 8, args.width // 8,
+                         dtype=torch.float16, device="cuda")
+    timestep = torch.ones(1, dtype=torch.float32, device="cuda")
+    cap_feats = torch.randn(128, config.cap_feat_dim, dtype=torch.float16, device="cuda")
+
+    # H, W and batch are fixed for a deck; only the prompt length varies per card
+    cap_len = torch.export.Dim("cap_len", min=2, max=512)
+
+    print(f"📦 Exporting to {onnx_path} (this takes a while)...")
+    with torch.no_grad():
+        torch.onnx.export(
+            TransformerExportWrapper(transformer),
+            (latent, timestep, cap_feats),
+            str(onnx_path),
+            input_names=["latent", "timestep", "cap_feats"],
+            output_names=["sample"],
+            dynamic_shapes={"latent": None, "timestep": None, "cap_feats": {0: cap_len}},
+            opset_version=18,
+            dynamo=True,
+            external_data=True,
+        )
+
+    print(f"✅ Exported: {onnx_path}")
+    print(f"   Use it with: python batch_generate.py --backend ort-cuda "
+          f"--height {args.height} --width {args.width}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Helpers shared by test_setup.py and test_setup_mac.py
+"""
+
+import hashlib
+
+import torch
+
+TEST_PROMPT = "A majestic ace of spades playing card design, Victorian steampunk style, ornate golden gears and clockwork elements, centered composition, detailed engraving technique, aged parchment background."
+
+# zlib level for the test PNGs: much cheaper to encode than Pillow's default 6 for a
+# slightly larger (still lossless) file
+PNG_COMPRESS_LEVEL = 1
+
+
+def embeds_cache_path(prompt, dtype, output_dir):
+    """Where the text-encoder output for a test prompt is cached after the first run."""
+    key = hashlib.sha256(f"{prompt}|{dtype}".encode()).hexdigest()[:16]
+    return output_dir / f"embeds_{key}.pt"
+
+
+def get_cached_embeds(pipe, prompt, device, cache_path):
+    """Text-encoder output for a test prompt, read from cache_path once it exists."""
+    if cache_path.exists():
+        return torch.load(cache_path, map_location=device, weights_only=True)
+
+    with torch.no_grad():
+        embeds, _ = pipe.encode_prompt(prompt, device=device, do_classifier_free_guidance=False)
+    torch.save(embeds, cache_path)
+    return embeds
+
+
+def text_encoder_overrides(skip):
+    """
+    from_pretrained overrides that leave out the text encoder when ``skip`` is set.
+
+    Pass skip once every prompt's embeddings are cached: the pipeline never calls the
+    text encoder, its largest component, when given prompt_embeds, so its weights
+    needn't be read at all.
+    """
+    return {"text_encoder": None, "tokenizer": None} if skip else {}
+
+
+def fuse_vae_attention(pipe):
+    """
+    One QKV matmul for the VAE's attention.
+
+    The transformer's Z-Image processor always calls to_q/to_k/to_v separately, so
+    fusing it would only add weights.
+    """
+    pipe.vae.fuse_qkv_projections()
+
+
+def to_channels_last(*components):
+    """channels_last suits the VAE's convs; components that can't take it stay NCHW."""
+    for component in components:
+        try:
+            component.to(memory_format=torch.channels_last)
+        except Exception:
+            pass
+
+
+def save_png_async(saver, image, output_path):
+    """Encode a test PNG on the saver thread; wait on the returned future before reporting success."""
+    return saver.submit(image.save, output_path, optimize=False, compress_level=PNG_COMPRESS_LEVEL)